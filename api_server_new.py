@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 import os
+import sys
 import json
 import socket
 import secrets
@@ -7,16 +8,25 @@ import uvicorn
 import contextlib
 import time
 import re
+import sqlite3
+import threading
 import asyncio
+import heapq
+import bisect
+import uuid
+import itertools
+import functools
+from collections import OrderedDict, deque
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 from fastapi import FastAPI, HTTPException, Depends, Security, status, Request, BackgroundTasks
 from fastapi.security.api_key import APIKeyHeader, APIKey
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
-from pyrogram import Client
+from typing import List, NamedTuple, Optional
+from pyrogram import Client, filters, raw, utils
 from contextlib import asynccontextmanager
 
 # Load environment variables
@@ -29,6 +39,118 @@ PHONE = os.getenv("PHONE", "")
 SESSION = os.getenv("LOGIN", "linkbot")
 LINKS_FILE = Path("links.json")
 
+# Linked chats are ingested through Pyrogram update handlers; history polling
+# is only a low-frequency catch-up for anything the push path missed
+MONITOR_FALLBACK_INTERVAL = int(os.getenv("MONITOR_FALLBACK_INTERVAL", "60"))
+
+# Per-chat "last seen message id" cursors, persisted across restarts
+CURSORS_FILE = Path("chat_cursors.json")
+HISTORY_PAGE_SIZE = 100  # Telegram returns at most 100 messages per request
+BOOTSTRAP_HISTORY_LIMIT = 10  # Messages read from a chat that has no cursor yet
+
+# Maximum number of linked chats fetched at the same time by the monitor
+MONITOR_CONCURRENCY = int(os.getenv("MONITOR_CONCURRENCY", "8"))
+
+# Adaptive per-chat polling: chats that just produced cabinet or cancellation
+# messages are polled every MONITOR_MIN_INTERVAL seconds, quiet chats back off
+# towards MONITOR_FALLBACK_INTERVAL, failing chats towards MONITOR_ERROR_INTERVAL
+MONITOR_MIN_INTERVAL = float(os.getenv("MONITOR_MIN_INTERVAL", "5"))
+MONITOR_ERROR_INTERVAL = float(os.getenv("MONITOR_ERROR_INTERVAL", "300"))
+MONITOR_BACKOFF_FACTOR = 1.5  # Interval growth per quiet poll
+MONITOR_FAILING_AFTER = 5  # Consecutive failed polls before a chat is reported as failing
+PEER_DIALOGS_BATCH = 100  # Dialogs requested per messages.getPeerDialogs call
+
+# How long /send waits for the payment bot's reply to be pushed before it
+# falls back to reading the chat history (the whole request is capped at 20 s)
+SEND_REPLY_TIMEOUT = float(os.getenv("SEND_REPLY_TIMEOUT", "15"))
+SEND_HISTORY_LIMIT = 20  # Messages read by the history fallback
+# An error-only reply is accepted after this many seconds unless the payment
+# confirmation arrives first
+SEND_ERROR_GRACE = float(os.getenv("SEND_ERROR_GRACE", "2"))
+
+# Async /send jobs: finished results stay queryable for JOB_RESULT_TTL seconds,
+# GET /jobs/{id} long-polls for at most JOB_MAX_WAIT seconds
+JOB_RESULT_TTL = float(os.getenv("JOB_RESULT_TTL", "600"))
+JOB_MAX_WAIT = float(os.getenv("JOB_MAX_WAIT", "30"))
+
+# Maximum number of messages accepted by one POST /send/batch
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "200"))
+
+# Event stream: the last EVENT_BUFFER_SIZE events are kept so reconnecting
+# clients can resume, each subscriber buffers at most EVENT_SUBSCRIBER_QUEUE
+EVENT_BUFFER_SIZE = int(os.getenv("EVENT_BUFFER_SIZE", "1000"))
+EVENT_SUBSCRIBER_QUEUE = int(os.getenv("EVENT_SUBSCRIBER_QUEUE", "100"))
+EVENT_KEEPALIVE_INTERVAL = 15  # Seconds between keep-alive comments on idle streams
+
+# Retention of stored cabinet and cancellation messages: entries older than
+# MESSAGE_RETENTION_HOURS or beyond the newest MESSAGE_RETENTION_PER_CHAT of
+# their chat are evicted (0 disables either limit)
+MESSAGE_RETENTION_HOURS = float(os.getenv("MESSAGE_RETENTION_HOURS", "72"))
+MESSAGE_RETENTION_PER_CHAT = int(os.getenv("MESSAGE_RETENTION_PER_CHAT", "10000"))
+HOUSEKEEPING_INTERVAL = 60  # Seconds between background retention sweeps
+
+# Durable SQLite store for cabinet and cancellation messages; new rows are
+# written in batches every EVENT_STORE_FLUSH_INTERVAL seconds
+EVENT_STORE_FILE = Path(os.getenv("EVENT_STORE_FILE", "events.db"))
+EVENT_STORE_FLUSH_INTERVAL = 0.2
+# A batch that fails to write EVENT_STORE_MAX_ATTEMPTS times in a row is
+# dropped, and at most EVENT_STORE_MAX_PENDING entries wait for a retry
+EVENT_STORE_MAX_ATTEMPTS = 10
+EVENT_STORE_MAX_PENDING = 100000
+
+# Processed message ids are remembered for PROCESSED_IDS_TTL seconds, and at
+# most PROCESSED_IDS_MAX of them are kept (oldest dropped first)
+PROCESSED_IDS_TTL = 86400
+PROCESSED_IDS_MAX = int(os.getenv("PROCESSED_IDS_MAX", "500000"))
+
+# Confirmed transaction ids are treated as duplicates for TRANSACTION_TTL
+# seconds (kept in the event store across restarts), at most
+# TRANSACTION_CACHE_MAX of them
+TRANSACTION_TTL = 3600
+TRANSACTION_CACHE_MAX = int(os.getenv("TRANSACTION_CACHE_MAX", "100000"))
+
+# Payouts that have stayed in a non-final state longer than this many seconds
+# are reported by GET /payouts/stuck
+PAYOUT_STUCK_AFTER = float(os.getenv("PAYOUT_STUCK_AFTER", "1800"))
+
+# Message classification rules (phrases and structured fields), re-read when
+# the file changes; the built-in defaults below apply while it doesn't exist,
+# and fill in any key or field the file leaves out (null disables a field)
+RESPONSE_RULES_FILE = Path(os.getenv("RESPONSE_RULES_FILE", "response_rules.json"))
+DEFAULT_RESPONSE_RULES = {
+    "phrases": [
+        {"text": "Выплата добавлена в очередь", "flag": "queued", "case_sensitive": True},
+        {"text": "невозможно обработать", "flag": "cancellation"},
+        {"text": "Exception: params count", "flag": "error", "case_sensitive": True,
+         "fatal": True, "message": "Failed: Exception params count error"},
+        {"text": "Exception:", "flag": "error", "case_sensitive": True},
+        {"text": "Error:", "flag": "error", "case_sensitive": True},
+        {"text": "ошибка", "flag": "error", "case_sensitive": True},
+        {"text": "Ошибка", "flag": "error", "case_sensitive": True},
+    ],
+    "fields": {
+        "cabinet": r"\A\[(?P<cabinet_name>\w+)#(?P<cabinet_id>\d+)\]\s+(?=[^:]+:(?P<content>(?s:.*)))",
+        # Statuses are lookaheads, so the rest of the line is still scanned;
+        # they end at the next id field or at the end of the sentence
+        "payout": r"Выплата#(?P<payout_id>\d+)(?=[^\S\n]*(?P<payout_status>(?:(?!Транзакция#|Выплата#|[.!?;](?:\s|$))[^\n])*))",
+        "transaction": r"Транзакция#(?P<transaction_id>\d+)(?=[^\S\n]*(?P<transaction_status>(?:(?!Транзакция#|Выплата#|[.!?;](?:\s|$))[^\n])*))",
+        "auto_withdraw": r"(?i:автовывод)\s*:\s*(?P<auto_withdraw>(?i:да|нет))",
+    },
+    "auto_withdraw_values": {"да": True, "нет": False},
+    # Cabinet payout statuses containing these words (case-insensitive) end
+    # the payout; any other status means it is still processing. A cancelling
+    # word wins over a completing one, and a completing word negated by "не"
+    # ("не выполнена", "неуспешно") cancels
+    "payout_states": {
+        "выполнен": "completed",
+        "выплачен": "completed",
+        "успешн": "completed",
+        "отмен": "cancelled",
+        "отклон": "cancelled",
+        "невозможно обработать": "cancelled",
+    },
+}
+
 # Generate API key if it doesn't exist
 API_KEY_FILE = Path(".api_key")
 if not API_KEY_FILE.exists():
@@ -48,21 +170,1463 @@ api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
 # Create Pyrogram client
 client = Client(SESSION, api_id=API_ID, api_hash=API_HASH, phone_number=PHONE)
 
-# Transaction cache to avoid processing the same transaction twice
-# Structure: {chat_id: {transaction_id: timestamp}}
-transaction_cache = {}
+# Payout lifecycle: sent by /send, queued by the payment bot, then reported by
+# cabinet messages until it is completed or cancelled
+PAYOUT_STATE_RANK = {"sent": 0, "queued": 1, "processing": 2, "completed": 3, "cancelled": 3}
+FINAL_PAYOUT_STATES = ("completed", "cancelled")
+
+class PhraseMatcher:
+    """Case-sensitive and case-insensitive phrases compiled into one regex.
+
+    The scan runs inside the re engine: a lookahead tries the alternation at
+    every position, so overlapping phrases are all found, and a match also
+    reports the shorter phrases it starts with. Whitespace in a phrase
+    matches any whitespace run.
+    """
+
+    CACHE_SIZE = 1024
+
+    def __init__(self, exact, folded):
+        self.exact = exact    # [(phrase, value)]
+        self.folded = folded  # [(lowercased phrase, value)]
+        alternatives = [(text, False) for text, _ in exact] + [(text, True) for text, _ in folded]
+        # Longest first, so at any position the longest phrase is the one matched
+        alternatives.sort(key=lambda alternative: len(alternative[0]), reverse=True)
+        patterns = []
+        for text, ignore_case in alternatives:
+            pattern = r"\s+".join(re.escape(word) for word in text.split(" "))
+            patterns.append(f"(?i:{pattern})" if ignore_case else pattern)
+        self.regex = re.compile(f"(?=({'|'.join(patterns)}))") if patterns else None
+        self.resolved = {}  # {matched text: values of the phrases it starts with}
+
+    def _values(self, matched):
+        key = normalize_phrase(matched)
+        values = self.resolved.get(key)
+        if values is None:
+            lowered = key.lower()
+            values = [value for text, value in self.exact if key.startswith(text)]
+            values += [value for text, value in self.folded if lowered.startswith(text)]
+            if len(self.resolved) >= self.CACHE_SIZE:
+                self.resolved.clear()
+            self.resolved[key] = values
+        return values
+
+    def find(self, text):
+        """Values of every phrase occurring in the text, in order of where they start"""
+        if self.regex is None:
+            return []
+        return [value for match in self.regex.finditer(text) for value in self._values(match.group(1))]
+
+# "не" as a word (or prefix) right before a payout status keyword
+NEGATION = re.compile(r"(?:^|\W)не\s*$")
+
+def normalize_phrase(text):
+    """Collapse whitespace runs to one space, as the matchers see texts"""
+    return " ".join(text.split())
+
+class ResponseRules:
+    """Classification rules from RESPONSE_RULES_FILE, compiled once per change.
+
+    Phrases (queued, cancellation and error markers) go into one regex
+    alternation, with case-insensitive phrases as (?i:...) groups, and the
+    structured fields into another combined regex, so a text is scanned
+    once per matcher however many rules there are. refresh() re-reads the file when its mtime
+    changes; the built-in defaults apply while it doesn't exist.
+    """
+
+    FLAGS = ("queued", "cancellation", "error")
+
+    def __init__(self, path, defaults):
+        self.path = path
+        self.defaults = defaults
+        self.mtime = None
+        self.compile(defaults)
+
+    def merged(self, rules):
+        """Rules with missing keys and fields filled in from the defaults.
+
+        A field set to null is disabled instead.
+        """
+        missing = [key for key in self.defaults if key not in rules]
+        missing += [f"fields.{name}" for name in self.defaults["fields"] if name not in rules.get("fields", {})]
+        if missing:
+            print(f"Response rules in {self.path} use the defaults for: {', '.join(missing)}")
+        merged = {**self.defaults, **rules}
+        fields = {**self.defaults["fields"], **rules.get("fields", {})}
+        merged["fields"] = {name: regex for name, regex in fields.items() if regex is not None}
+        return merged
+
+    def compile(self, rules):
+        exact, folded = [], []
+        for rule in rules["phrases"]:
+            if rule["flag"] not in self.FLAGS:
+                raise ValueError(f"Unknown rule flag: {rule['flag']}")
+            text = normalize_phrase(rule["text"])
+            if rule.get("case_sensitive"):
+                exact.append((text, rule))
+            else:
+                folded.append((text.lower(), rule))
+        fields = re.compile("|".join(f"(?:{regex})" for regex in rules["fields"].values()))
+        payout_states = [(word.lower(), state) for word, state in rules["payout_states"].items()]
+        for _, state in payout_states:
+            if state not in PAYOUT_STATE_RANK:
+                raise ValueError(f"Unknown payout state: {state}")
+
+        # Swap everything at once, then forget results classified by the old rules
+        self.phrase_matcher = PhraseMatcher(exact, folded)
+        self.fields = fields
+        self.auto_withdraw_values = {key.lower(): value for key, value in rules["auto_withdraw_values"].items()}
+        self.payout_states = payout_states
+        classify_message.cache_clear()
+
+    def refresh(self):
+        """Recompile the rules if the file changed on disk"""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        try:
+            if mtime is None:
+                self.compile(self.defaults)
+            else:
+                with self.path.open("r", encoding="utf-8") as f:
+                    self.compile(self.merged(json.load(f)))
+        except Exception as e:
+            # Any malformed file, including one of the wrong shape, keeps the
+            # current rules; remember its mtime so it's parsed again only
+            # once it changes
+            print(f"Error loading response rules from {self.path}: {e!r}")
+            self.mtime = mtime
+            return
+        self.mtime = mtime
+        print(f"Loaded response rules from {self.path if mtime else 'built-in defaults'}")
+
+    def phrases(self, text):
+        """Rules whose phrase occurs in the text, in order of where they start"""
+        return self.phrase_matcher.find(text)
+
+    def payout_state(self, status):
+        """Lifecycle state a cabinet payout status stands for"""
+        status = status.lower()
+        found = None
+        for word, state in self.payout_states:
+            start = status.find(word)
+            while start != -1:
+                if state == "completed" and NEGATION.search(status, 0, start):
+                    return "cancelled"
+                if state == "cancelled":
+                    return state
+                if found is None:
+                    found = state
+                start = status.find(word, start + 1)
+        return found or "processing"
+
+    def fields_in(self, text):
+        """First value of every structured field group found in the text"""
+        found = {}
+        for match in self.fields.finditer(text):
+            for name, value in match.groupdict().items():
+                if value is not None:
+                    found.setdefault(name, value)
+        return found
+
+class MessageClass(NamedTuple):
+    """What classify_message found in a text"""
+    kind: str  # "cabinet", "cancellation", "payment_queued", "error" or "other"
+    cabinet_name: Optional[str] = None
+    cabinet_id: Optional[str] = None
+    content: Optional[str] = None  # Cabinet message text after the header
+    cancellation: bool = False  # A cabinet message can be a cancellation too
+    queued: bool = False
+    transaction_id: Optional[str] = None
+    auto_withdraw: Optional[bool] = None
+    error: Optional[str] = None  # Error marker found, a fatal one wins
+    error_message: Optional[str] = None  # Set for fatal errors, which override success
+    payout_id: Optional[str] = None  # Выплата# id, else Транзакция# id
+    payout_status: Optional[str] = None  # Text after the id, up to the next id or sentence end
+    payout_state: Optional[str] = None  # Lifecycle state the status stands for
+
+    @property
+    def is_reply(self):
+        """Whether the text looks like the payment bot's answer to a /send.
+
+        Cabinet notifications share the chat and may mention errors, they
+        only count when they explicitly reply to the sent message.
+        """
+        return self.kind != "cabinet" and (self.queued or self.error is not None)
+
+@functools.lru_cache(maxsize=1024)
+def classify_message(text):
+    """
+    Classify a message with the current response rules.
+
+    Cached, so the update handler, pending replies, the parsers and
+    analyze_response all share the result for the same text.
+    """
+    flags = set()
+    error = fatal = None
+    for rule in response_rules.phrases(text):
+        flags.add(rule["flag"])
+        if rule["flag"] != "error":
+            continue
+        if rule.get("fatal") and fatal is None:
+            fatal = rule
+        if error is None:
+            error = rule
+    if fatal is not None:
+        error = fatal
+
+    fields = response_rules.fields_in(text)
+    cabinet_name, cabinet_id = fields.get("cabinet_name"), fields.get("cabinet_id")
+    content = fields.get("content")
+    auto_withdraw = fields.get("auto_withdraw")
+    if "payout_id" in fields:
+        payout_id, payout_status = fields["payout_id"], fields.get("payout_status")
+    else:
+        payout_id, payout_status = fields.get("transaction_id"), fields.get("transaction_status")
+    if payout_id is not None:
+        payout_status = (payout_status or "").strip(" .")
+
+    if cabinet_name is not None:
+        kind = "cabinet"
+    elif "cancellation" in flags:
+        kind = "cancellation"
+    elif fatal is not None:
+        kind = "error"
+    elif "queued" in flags:
+        kind = "payment_queued"
+    elif error is not None:
+        kind = "error"
+    else:
+        kind = "other"
+
+    return MessageClass(
+        kind=kind,
+        cabinet_name=cabinet_name,
+        cabinet_id=cabinet_id,
+        content=None if content is None else content.strip(),
+        cancellation="cancellation" in flags,
+        queued="queued" in flags,
+        transaction_id=fields.get("transaction_id"),
+        auto_withdraw=None if auto_withdraw is None else response_rules.auto_withdraw_values.get(auto_withdraw.lower()),
+        error=None if error is None else error["text"],
+        error_message=None if fatal is None else fatal.get("message", fatal["text"]),
+        payout_id=payout_id,
+        payout_status=payout_status,
+        payout_state=None if payout_id is None else response_rules.payout_state(payout_status)
+    )
+
+response_rules = ResponseRules(RESPONSE_RULES_FILE, DEFAULT_RESPONSE_RULES)
+
+def entry_sort_key(entry):
+    return (entry["timestamp"], entry["message_id"] or 0)
+
+# Public fields of stored entries, in the order the read endpoints return them
+CABINET_FIELDS = ("chat_id", "chat_name", "cabinet_name", "cabinet_id", "message", "timestamp", "message_id")
+CANCELLATION_FIELDS = ("chat_id", "chat_name", "message", "timestamp", "message_id")
+
+def encode_entry(entry, fields):
+    """JSON fragment of an entry, built once and reused by every response"""
+    data = {field: entry[field] for field in fields}
+    data["timestamp"] = float(data["timestamp"])
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+
+class StoredMessage:
+    """Compact stored entry: a __slots__ record with interned names.
+
+    The message text is kept only inside the encoded JSON payload. Records
+    support entry["field"] and entry.get(), like the dicts they replace.
+    """
+
+    __slots__ = ()
+    FIELDS = ()
+
+    def __init__(self, payload, **values):
+        for field, value in values.items():
+            # Chat and cabinet names repeat in every record, keep one copy
+            setattr(self, field, sys.intern(value) if isinstance(value, str) else value)
+        self.payload = payload
+
+    @classmethod
+    def create(cls, **values):
+        """New record, encoding its payload from the given field values"""
+        payload = encode_entry(values, cls.FIELDS)
+        del values["message"]
+        return cls(payload, **values)
+
+    @classmethod
+    def from_row(cls, row):
+        """Record for an event-store row that already carries its payload"""
+        return cls(row["payload"], **{field: row[field] for field in cls.FIELDS if field != "message"})
+
+    @property
+    def message(self):
+        return json.loads(self.payload)["message"]
+
+    def __getitem__(self, field):
+        return getattr(self, field)
+
+    def get(self, field, default=None):
+        return getattr(self, field, default)
+
+class CabinetRecord(StoredMessage):
+    __slots__ = ("chat_id", "chat_name", "cabinet_name", "cabinet_id", "timestamp", "message_id", "payload")
+    FIELDS = CABINET_FIELDS
+
+class CancellationRecord(StoredMessage):
+    __slots__ = ("chat_id", "chat_name", "timestamp", "message_id", "payload")
+    FIELDS = CANCELLATION_FIELDS
+
+class SortedRun:
+    """Entries kept sorted by (timestamp, message_id), bisected through entry_sort_key.
+
+    Evicting the oldest entry only moves a start offset; the evicted slots
+    are compacted away once they make up half of the list.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.start = 0
+
+    def add(self, entry):
+        # Messages mostly arrive in order, so this is almost always an append
+        i = bisect.bisect_right(self.entries, entry_sort_key(entry), lo=self.start, key=entry_sort_key)
+        self.entries.insert(i, entry)
+
+    def since(self, timestamp):
+        """Entries with timestamp >= the given one, oldest first"""
+        i = bisect.bisect_left(self.entries, (timestamp, float("-inf")), lo=self.start, key=entry_sort_key)
+        return self.entries[i:]
+
+    def head(self):
+        """Oldest entry"""
+        return self.entries[self.start]
+
+    def popleft(self):
+        """Remove and return the oldest entry"""
+        entry = self.entries[self.start]
+        self.entries[self.start] = None
+        self.start += 1
+        if self.start >= 32 and self.start * 2 >= len(self.entries):
+            del self.entries[:self.start]
+            self.start = 0
+        return entry
+
+    def __len__(self):
+        return len(self.entries) - self.start
+
+def index_key(value):
+    """Normalized value used as a secondary index key (case-insensitive)"""
+    return str(value).lower()
+
+class MessageLog:
+    """Per-chat sorted runs; time-window queries are a bisect per chat plus a merge.
+
+    Secondary indexes on index_fields hold their own per-chat sorted runs, so
+    a query filtered by one of those fields only touches matching entries.
+    Retention evicts from the old end of the runs as entries are added.
+    """
+
+    def __init__(self, index_fields=(), max_age=0, max_per_chat=0):
+        self.runs = {}  # {chat_id: SortedRun}
+        # Structure: {field: {normalized_value: {chat_id: SortedRun}}}
+        self.indexes = {field: {} for field in index_fields}
+        self.max_age = max_age            # Seconds, 0 = keep forever
+        self.max_per_chat = max_per_chat  # 0 = no limit
+        self.size = 0
+        self.evicted = {"age": 0, "count": 0}
+        # Structure: {chat_id: timestamp of the newest entry evicted by count}
+        self.count_evicted_until = {}
+
+    def add(self, entry):
+        chat_id = entry["chat_id"]
+        run = self.runs.get(chat_id)
+        if run is None:
+            run = self.runs[chat_id] = SortedRun()
+        run.add(entry)
+        self.size += 1
+
+        for field, index in self.indexes.items():
+            chat_runs = index.setdefault(index_key(entry[field]), {})
+            index_run = chat_runs.get(chat_id)
+            if index_run is None:
+                index_run = chat_runs[chat_id] = SortedRun()
+            index_run.add(entry)
+
+        self.enforce_retention(chat_id, time.time())
+
+    def _evict_oldest(self, chat_id, reason):
+        run = self.runs[chat_id]
+        entry = run.popleft()
+        self.size -= 1
+        self.evicted[reason] += 1
+        if reason == "count":
+            # Entries come out oldest first, so this only moves forward
+            self.count_evicted_until[chat_id] = entry["timestamp"]
+
+        # The chat's oldest entry is also the oldest in its index runs
+        for field, index in self.indexes.items():
+            key = index_key(entry[field])
+            chat_runs = index[key]
+            index_run = chat_runs[chat_id]
+            if index_run.head() is entry:
+                index_run.popleft()
+            if not index_run:
+                del chat_runs[chat_id]
+                if not chat_runs:
+                    del index[key]
+
+        if not run:
+            del self.runs[chat_id]
+
+    def enforce_retention(self, chat_id, now):
+        """Evict the chat's entries beyond the count limit or older than max_age"""
+        run = self.runs.get(chat_id)
+        while run and self.max_per_chat and len(run) > self.max_per_chat:
+            self._evict_oldest(chat_id, "count")
+        cutoff = now - self.max_age
+        while run and self.max_age and run.head()["timestamp"] < cutoff:
+            self._evict_oldest(chat_id, "age")
+
+    def expire(self, now):
+        """Age out old entries in every chat, touching only what gets evicted"""
+        for chat_id in list(self.runs):
+            self.enforce_retention(chat_id, now)
+
+    def holds_since(self, since, chat_id=None):
+        """Whether every entry from since on (in one chat, or all) is still held"""
+        if self.max_age and since < time.time() - self.max_age:
+            return False
+        if chat_id is not None:
+            evicted_until = self.count_evicted_until.get(chat_id, float("-inf"))
+        else:
+            evicted_until = max(self.count_evicted_until.values(), default=float("-inf"))
+        return since > evicted_until
+
+    def stats(self):
+        return {
+            "stored": self.size,
+            "chats": len(self.runs),
+            "evicted_by_age": self.evicted["age"],
+            "evicted_by_count": self.evicted["count"]
+        }
+
+    def select_runs(self, chat_id=None, filters=None):
+        """Smallest set of runs that holds every entry matching the filters"""
+        for field, value in (filters or {}).items():
+            chat_runs = self.indexes[field].get(index_key(value), {})
+            if chat_id is not None:
+                return [chat_runs[chat_id]] if chat_id in chat_runs else []
+            return list(chat_runs.values())
+        if chat_id is not None:
+            return [self.runs[chat_id]] if chat_id in self.runs else []
+        return list(self.runs.values())
+
+    def query(self, since=None, chat_id=None, **filters):
+        """Entries newer than since (all if None) matching the filters, newest first.
+
+        Filters are exact, case-insensitive matches on indexed fields.
+        """
+        filters = {field: value for field, value in filters.items() if value is not None}
+        since = float("-inf") if since is None else since
+        merged = heapq.merge(
+            *(reversed(run.since(since)) for run in self.select_runs(chat_id, filters)),
+            key=entry_sort_key,
+            reverse=True
+        )
+        # The first filter picked the runs, any others are checked per entry
+        extra = [(field, index_key(value)) for field, value in list(filters.items())[1:]]
+        if not extra:
+            return merged
+        return (entry for entry in merged if all(index_key(entry[field]) == value for field, value in extra))
+
+    def __len__(self):
+        return self.size
 
 # Message history storage
-# Structure: {chat_id: [{"cabinet_name": str, "cabinet_id": str, "message": str, "timestamp": float, "message_id": int}]}
-message_history = {}
+# Entries: CabinetRecord
+message_history = MessageLog(
+    index_fields=("cabinet_name", "cabinet_id"),
+    max_age=MESSAGE_RETENTION_HOURS * 3600,
+    max_per_chat=MESSAGE_RETENTION_PER_CHAT
+)
 
 # Cancellation message storage
-# Structure: {chat_id: [{"message": str, "timestamp": float, "message_id": int}]}
-cancellation_messages = {}
+# Entries: CancellationRecord
+cancellation_messages = MessageLog(
+    max_age=MESSAGE_RETENTION_HOURS * 3600,
+    max_per_chat=MESSAGE_RETENTION_PER_CHAT
+)
+
+class PayoutIndex:
+    """Payout status updates from cabinet messages, hashed by payout id.
+
+    Each payout keeps its timeline in a SortedRun, so the latest status is
+    its last entry. Payouts are ordered by their last update and expired
+    from the front once it is older than max_age seconds.
+    """
+
+    def __init__(self, max_age=0):
+        self.max_age = max_age
+        self.payouts = OrderedDict()  # {payout_id: SortedRun of status events}
+
+    def add(self, payout_id, event):
+        timeline = self.payouts.get(payout_id)
+        if timeline is None:
+            timeline = self.payouts[payout_id] = SortedRun()
+        timeline.add(event)
+        self.payouts.move_to_end(payout_id)
+
+    def get(self, payout_id):
+        """Status events of a payout, oldest first, or None if it isn't known"""
+        timeline = self.payouts.get(payout_id)
+        return None if timeline is None else timeline.entries[timeline.start:]
+
+    def merge(self, old_id, payout_id):
+        """Move the timeline indexed under old_id onto payout_id"""
+        timeline = self.payouts.pop(old_id, None)
+        if timeline is not None:
+            for event in timeline.entries[timeline.start:]:
+                self.add(payout_id, event)
+
+    def expire(self, now):
+        if not self.max_age:
+            return
+        cutoff = now - self.max_age
+        while self.payouts:
+            payout_id, timeline = next(iter(self.payouts.items()))
+            if timeline.entries[-1]["timestamp"] >= cutoff:
+                break
+            del self.payouts[payout_id]
+
+    def __len__(self):
+        return len(self.payouts)
+
+# Structure: {payout_id: [{"status": str, "timestamp": float, "chat_id": int,
+#             "cabinet_name": str, "cabinet_id": str, "message_id": int}]}
+payout_index = PayoutIndex(max_age=MESSAGE_RETENTION_HOURS * 3600)
+
+class PayoutLifecycle:
+    """When one payout first reached each lifecycle state"""
+
+    __slots__ = ("payout_id", "aliases", "chat_id", "status", "status_at", "milestones", "updated_at")
+
+    def __init__(self, payout_id):
+        self.payout_id = payout_id
+        self.aliases = []       # Transaction ids linked to this payout
+        self.chat_id = None
+        self.status = None      # Latest cabinet status text
+        self.status_at = None
+        self.milestones = {}    # {state: timestamp}
+        self.updated_at = None  # Newest event time
+
+    @property
+    def state(self):
+        # The furthest state reached; of two final states the earlier counts
+        return max(self.milestones, key=lambda state: (PAYOUT_STATE_RANK[state], -self.milestones[state]))
+
+    @property
+    def state_since(self):
+        return self.milestones[self.state]
+
+    @property
+    def started_at(self):
+        return min(self.milestones.values())
+
+    @property
+    def finished(self):
+        return self.state in FINAL_PAYOUT_STATES
+
+    def latency(self):
+        """Seconds from the first event to completion or cancellation"""
+        return self.state_since - self.started_at if self.finished else None
+
+class PayoutTracker:
+    """Payout lifecycle state machine joining /send confirmations, cabinet
+    status updates and cancellations by payout (transaction) id.
+
+    Events can arrive out of order (catch-up polls, startup warm-up), so each
+    state keeps the earliest time it was reached and the current state is the
+    furthest one; the result doesn't depend on arrival order. Payouts are
+    ordered by their last event and expired from the front like PayoutIndex.
+
+    /send replies carry a Транзакция# id and cabinet updates a Выплата# id.
+    When a text carries both, link() records the transaction id as an alias
+    of the payout id and folds anything already tracked under it into the
+    payout; record() and get() resolve ids through the aliases.
+    """
+
+    def __init__(self, max_age=0):
+        self.max_age = max_age
+        self.payouts = OrderedDict()  # {payout_id: PayoutLifecycle}
+        self.open = {}                # Payouts not completed or cancelled yet
+        self.aliases = {}             # {transaction_id: payout_id}
+
+    def resolve(self, payout_id):
+        return self.aliases.get(payout_id, payout_id)
+
+    def link(self, transaction_id, payout_id):
+        """Join transaction_id to a tracked payout; True if it wasn't linked yet"""
+        payout = self.payouts.get(payout_id)
+        if payout is None or self.aliases.get(transaction_id) == payout_id:
+            return False
+        self.aliases[transaction_id] = payout_id
+        payout.aliases.append(transaction_id)
+
+        merged = self.payouts.pop(transaction_id, None)
+        self.open.pop(transaction_id, None)
+        if merged is not None:
+            for state, timestamp in merged.milestones.items():
+                self.record(payout_id, state, timestamp, chat_id=merged.chat_id)
+            if merged.status is not None and (payout.status_at is None or merged.status_at > payout.status_at):
+                payout.status, payout.status_at = merged.status, merged.status_at
+            for alias in merged.aliases:
+                self.aliases[alias] = payout_id
+                payout.aliases.append(alias)
+        return True
+
+    def record(self, payout_id, state, timestamp, chat_id=None, status=None):
+        payout_id = self.resolve(payout_id)
+        payout = self.payouts.get(payout_id)
+        if payout is None:
+            payout = self.payouts[payout_id] = PayoutLifecycle(payout_id)
+        self.payouts.move_to_end(payout_id)
+
+        if payout.chat_id is None:
+            payout.chat_id = chat_id
+        if status is not None and (payout.status_at is None or timestamp >= payout.status_at):
+            payout.status, payout.status_at = status, timestamp
+        if payout.updated_at is None or timestamp > payout.updated_at:
+            payout.updated_at = timestamp
+        if state not in payout.milestones or timestamp < payout.milestones[state]:
+            payout.milestones[state] = timestamp
+
+        if payout.finished:
+            self.open.pop(payout_id, None)
+        else:
+            self.open[payout_id] = payout
+        return payout
+
+    def get(self, payout_id):
+        return self.payouts.get(self.resolve(payout_id))
+
+    def stuck(self, older_than, now):
+        """Open payouts that haven't changed state for older_than seconds, longest stuck first"""
+        stuck = [payout for payout in self.open.values() if now - payout.state_since >= older_than]
+        stuck.sort(key=lambda payout: payout.state_since)
+        return stuck
+
+    def expire(self, now):
+        if not self.max_age:
+            return
+        cutoff = now - self.max_age
+        while self.payouts:
+            payout_id, payout = next(iter(self.payouts.items()))
+            if payout.updated_at >= cutoff:
+                break
+            del self.payouts[payout_id]
+            self.open.pop(payout_id, None)
+            for alias in payout.aliases:
+                self.aliases.pop(alias, None)
+
+    def __len__(self):
+        return len(self.payouts)
+
+payout_tracker = PayoutTracker(max_age=MESSAGE_RETENTION_HOURS * 3600)
+
+def link_payout_ids(classification):
+    """Join a text's Транзакция# id to its Выплата# id when it carries both"""
+    transaction_id, payout_id = classification.transaction_id, classification.payout_id
+    if transaction_id is None or payout_id is None or transaction_id == payout_id:
+        return
+    if payout_tracker.link(transaction_id, payout_id):
+        payout_index.merge(transaction_id, payout_id)
+
+def index_payout(classification, entry):
+    """Record the payout status a cabinet message reports, if any"""
+    if classification.payout_id is None:
+        return
+    payout_index.add(payout_tracker.resolve(classification.payout_id), {
+        "status": classification.payout_status,
+        "timestamp": entry["timestamp"],
+        "chat_id": entry["chat_id"],
+        "cabinet_name": entry["cabinet_name"],
+        "cabinet_id": entry["cabinet_id"],
+        "message_id": entry["message_id"]
+    })
+    payout_tracker.record(
+        classification.payout_id, classification.payout_state, entry["timestamp"],
+        chat_id=entry["chat_id"], status=classification.payout_status
+    )
+    link_payout_ids(classification)
+
+def track_cancellation(classification, entry):
+    """Mark the payout a cancellation message names, if it names one"""
+    if classification.payout_id is not None:
+        payout_tracker.record(classification.payout_id, "cancelled", entry["timestamp"], chat_id=entry["chat_id"])
+        link_payout_ids(classification)
+
+class EventStore:
+    """SQLite (WAL) store behind message_history and cancellation_messages.
+
+    Entries are queued by the parsers and inserted in short batched
+    transactions on a worker thread, so the event loop never waits on disk.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS cabinet_messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            chat_name TEXT NOT NULL,
+            cabinet_name TEXT NOT NULL,
+            cabinet_key TEXT NOT NULL,
+            cabinet_id TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            message_id INTEGER,
+            payload BLOB
+        );
+        CREATE INDEX IF NOT EXISTS cabinet_messages_timestamp ON cabinet_messages (timestamp);
+        CREATE INDEX IF NOT EXISTS cabinet_messages_cabinet ON cabinet_messages (cabinet_key, timestamp);
+        CREATE INDEX IF NOT EXISTS cabinet_messages_cabinet_id ON cabinet_messages (cabinet_id, timestamp);
+        CREATE UNIQUE INDEX IF NOT EXISTS cabinet_messages_message ON cabinet_messages (chat_id, message_id);
+
+        CREATE TABLE IF NOT EXISTS cancellation_messages (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            chat_name TEXT NOT NULL,
+            message TEXT NOT NULL,
+            timestamp REAL NOT NULL,
+            message_id INTEGER,
+            payload BLOB
+        );
+        CREATE INDEX IF NOT EXISTS cancellation_messages_timestamp ON cancellation_messages (timestamp);
+        CREATE UNIQUE INDEX IF NOT EXISTS cancellation_messages_message ON cancellation_messages (chat_id, message_id);
+
+        CREATE TABLE IF NOT EXISTS transactions (
+            chat_id INTEGER NOT NULL,
+            transaction_id TEXT NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (chat_id, transaction_id)
+        );
+        CREATE INDEX IF NOT EXISTS transactions_expires_at ON transactions (expires_at);
+    """
+
+    # Rows carry the record's encoded JSON fragment, so reads don't re-encode
+    CABINET_COLUMNS = ", ".join(CABINET_FIELDS + ("payload",))
+    CANCELLATION_COLUMNS = ", ".join(CANCELLATION_FIELDS + ("payload",))
+
+    def __init__(self, path):
+        self.path = path
+        self.write_conn = None
+        self.read_conn = None
+        self.read_lock = threading.Lock()
+        self.flush_lock = asyncio.Lock()
+        self.pending = []  # [(kind, entry)] waiting for the next batch
+        self.failures = 0  # Failed writes of the pending entries in a row
+        self.dropped = 0   # Entries given up on after repeated failures
+
+    @property
+    def is_open(self):
+        return self.write_conn is not None
+
+    def open(self):
+        self.write_conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.write_conn.execute("PRAGMA journal_mode=WAL")
+        self.write_conn.execute("PRAGMA synchronous=NORMAL")
+        self.write_conn.executescript(self.SCHEMA)
+        # Stores created before the payload column get it added; their old
+        # rows are encoded when read
+        for table in ("cabinet_messages", "cancellation_messages"):
+            columns = {row[1] for row in self.write_conn.execute(f"PRAGMA table_info({table})")}
+            if "payload" not in columns:
+                self.write_conn.execute(f"ALTER TABLE {table} ADD COLUMN payload BLOB")
+        self.read_conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.read_conn.row_factory = sqlite3.Row
+
+    def close(self):
+        for conn in (self.write_conn, self.read_conn):
+            if conn is not None:
+                conn.close()
+        self.write_conn = self.read_conn = None
+
+    def append(self, kind, entry):
+        """Queue a cabinet, cancellation or transaction entry for the next batch"""
+        if self.is_open:
+            self.pending.append((kind, entry))
+
+    def _write_batch(self, batch):
+        cabinet_rows = [
+            (e["chat_id"], e["chat_name"], e["cabinet_name"], index_key(e["cabinet_name"]),
+             e["cabinet_id"], e["message"], e["timestamp"], e["message_id"], e["payload"])
+            for kind, e in batch if kind == "cabinet"
+        ]
+        cancellation_rows = [
+            (e["chat_id"], e["chat_name"], e["message"], e["timestamp"], e["message_id"], e["payload"])
+            for kind, e in batch if kind == "cancellation"
+        ]
+        transaction_rows = [
+            (e["chat_id"], e["transaction_id"], e["expires_at"])
+            for kind, e in batch if kind == "transaction"
+        ]
+        # One short transaction per batch; rows already stored before a
+        # restart are skipped by the unique (chat_id, message_id) indexes
+        with self.write_conn:
+            self.write_conn.executemany(
+                "INSERT OR IGNORE INTO cabinet_messages (chat_id, chat_name, cabinet_name, cabinet_key, "
+                "cabinet_id, message, timestamp, message_id, payload) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                cabinet_rows
+            )
+            self.write_conn.executemany(
+                "INSERT OR IGNORE INTO cancellation_messages (chat_id, chat_name, message, timestamp, message_id, payload) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                cancellation_rows
+            )
+            if transaction_rows:
+                self.write_conn.executemany(
+                    "INSERT OR REPLACE INTO transactions (chat_id, transaction_id, expires_at) VALUES (?, ?, ?)",
+                    transaction_rows
+                )
+                # Expired rows are dropped through the expires_at index
+                self.write_conn.execute("DELETE FROM transactions WHERE expires_at <= ?", (time.time(),))
+
+    async def flush(self):
+        """Write every queued entry in one transaction off the event loop"""
+        async with self.flush_lock:
+            if not self.pending or not self.is_open:
+                return
+            batch, self.pending = self.pending, []
+            try:
+                await asyncio.to_thread(self._write_batch, batch)
+            except Exception:
+                self.failures += 1
+                if self.failures >= EVENT_STORE_MAX_ATTEMPTS:
+                    # Give up on the batch; entries queued since are kept
+                    self.dropped += len(batch)
+                    self.failures = 0
+                    print(f"Dropped {len(batch)} event store entries after {EVENT_STORE_MAX_ATTEMPTS} failed writes")
+                else:
+                    # Keep the batch for the next attempt
+                    self.pending[:0] = batch
+                overflow = len(self.pending) - EVENT_STORE_MAX_PENDING
+                if overflow > 0:
+                    del self.pending[:overflow]
+                    self.dropped += overflow
+                    print(f"Dropped {overflow} oldest event store entries, retry queue is full")
+                raise
+            self.failures = 0
+
+    async def flush_for_read(self):
+        """Flush before a read, falling back to what is already committed.
+
+        Failed writes are left to flush_event_store to retry, so a locked
+        database doesn't fail every read.
+        """
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error writing to event store, reading committed entries only: {e}")
+
+    def _read(self, sql, params, fields=None):
+        with self.read_lock:
+            rows = [dict(row) for row in self.read_conn.execute(sql, params)]
+        if fields:
+            # Rows written before the payload column are encoded here, on
+            # the worker thread
+            for row in rows:
+                if row["payload"] is None:
+                    row["payload"] = encode_entry(row, fields)
+        return rows
+
+    def _read_page(self, table, sql, params, fields):
+        # The high-water seq is taken first and bounds the page, so rows
+        # committed in between are left for the next sync
+        with self.read_lock:
+            upper = self.read_conn.execute(f"SELECT COALESCE(MAX(seq), 0) FROM {table}").fetchone()[0]
+        return self._read(sql, params + [upper], fields), upper
+
+    def _select(self, kind, since=None, chat_id=None, cabinet_name=None, cabinet_id=None,
+                before=None, after=None, after_seq=None):
+        table, columns, fields = (
+            ("cabinet_messages", self.CABINET_COLUMNS, CABINET_FIELDS) if kind == "cabinet"
+            else ("cancellation_messages", self.CANCELLATION_COLUMNS, CANCELLATION_FIELDS)
+        )
+        conditions, params = [], []
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if chat_id is not None:
+            conditions.append("chat_id = ?")
+            params.append(chat_id)
+        if cabinet_name is not None:
+            conditions.append("cabinet_key = ?")
+            params.append(index_key(cabinet_name))
+        if cabinet_id is not None:
+            conditions.append("cabinet_id = ?")
+            params.append(cabinet_id)
+        # Keyset bounds on (timestamp, message_id); the timestamp index
+        # narrows the range, message_id only breaks ties
+        if before is not None:
+            conditions.append("(timestamp < ? OR (timestamp = ? AND COALESCE(message_id, 0) < ?))")
+            params.extend((before[0], before[0], before[1]))
+        if after is not None:
+            conditions.append("(timestamp > ? OR (timestamp = ? AND COALESCE(message_id, 0) > ?))")
+            params.extend((after[0], after[0], after[1]))
+        if after_seq is not None:
+            conditions.append("seq > ?")
+            params.append(after_seq)
+        return table, columns, fields, conditions, params
+
+    async def query(self, kind, since=None, chat_id=None, cabinet_name=None, cabinet_id=None):
+        """Stored entries matching the filters, newest first"""
+        # Make sure entries accepted so far are visible to this read
+        await self.flush_for_read()
+
+        table, columns, fields, conditions, params = self._select(kind, since, chat_id, cabinet_name, cabinet_id)
+        sql = f"SELECT {columns} FROM {table}"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        sql += " ORDER BY timestamp DESC, message_id DESC"
+        return await asyncio.to_thread(self._read, sql, params, fields)
+
+    async def page(self, kind, limit=None, before=None, after=None, after_seq=None, **filters):
+        """
+        One page of stored entries plus the store's high-water seq.
+
+        Entries come newest first, oldest first when paging forward with
+        `after`, and in insertion order when syncing with `after_seq`.
+        """
+        await self.flush_for_read()
+
+        table, columns, fields, conditions, params = self._select(
+            kind, before=before, after=after, after_seq=after_seq, **filters
+        )
+        conditions.append("seq <= ?")
+        if after_seq is not None:
+            order = "seq"
+        elif after is not None:
+            order = "timestamp, message_id"
+        else:
+            order = "timestamp DESC, message_id DESC"
+        sql = f"SELECT seq, {columns} FROM {table} WHERE {' AND '.join(conditions)} ORDER BY {order}"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        return await asyncio.to_thread(self._read_page, table, sql, params, fields)
+
+    async def load_transactions(self):
+        """Unexpired transaction ids, soonest to expire first"""
+        return await asyncio.to_thread(
+            self._read,
+            "SELECT chat_id, transaction_id, expires_at FROM transactions WHERE expires_at > ? ORDER BY expires_at",
+            (time.time(),)
+        )
+
+event_store = EventStore(EVENT_STORE_FILE)
+
+async def flush_event_store():
+    """Background task writing queued entries to the event store in batches"""
+    while True:
+        await asyncio.sleep(EVENT_STORE_FLUSH_INTERVAL)
+        try:
+            await event_store.flush()
+        except Exception as e:
+            print(f"Error writing to event store: {e}")
+
+async def load_event_store():
+    """Open the event store and warm the in-memory history with retained entries"""
+    await asyncio.to_thread(event_store.open)
+
+    since = time.time() - MESSAGE_RETENTION_HOURS * 3600 if MESSAGE_RETENTION_HOURS else None
+    for kind, log in (("cabinet", message_history), ("cancellation", cancellation_messages)):
+        record = CabinetRecord if kind == "cabinet" else CancellationRecord
+        entries = await event_store.query(kind, since=since)
+        for entry in reversed(entries):
+            if kind == "cabinet":
+                index_payout(classify_message(entry["message"]), entry)
+            else:
+                track_cancellation(classify_message(entry["message"]), entry)
+            entry = record.from_row(entry)
+            log.add(entry)
+            # Don't ingest these again when the catch-up poll sees them
+            if entry["message_id"] is not None:
+                processed_message_ids.add((entry["chat_id"], entry["message_id"], kind))
+        print(f"Loaded {len(entries)} stored {kind} messages")
+
+    # Restore the duplicate transaction cache
+    transactions = await event_store.load_transactions()
+    for row in transactions:
+        transaction_cache.add((row["chat_id"], row["transaction_id"]), expires_at=row["expires_at"])
+        # Confirmed by the payment bot when it entered the cache
+        payout_tracker.record(row["transaction_id"], "queued", row["expires_at"] - TRANSACTION_TTL, chat_id=row["chat_id"])
+    print(f"Loaded {len(transactions)} cached transactions")
+
+class ExpiringIdSet:
+    """Set whose keys expire ttl seconds after they were added, capped at max_size.
+
+    Keys are queued in insertion order, which is also expiry order, so
+    expiring or evicting pops from the front: every operation is amortized O(1).
+    """
+
+    def __init__(self, ttl, max_size):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.expires = {}     # {key: expires_at}
+        self.order = deque()  # (expires_at, key) oldest first
+        self.evicted = 0      # Keys dropped early because of max_size
+
+    def expire(self, now=None):
+        now = time.time() if now is None else now
+        while self.order and self.order[0][0] <= now:
+            expires_at, key = self.order.popleft()
+            if self.expires.get(key) == expires_at:
+                del self.expires[key]
+
+    def add(self, key, expires_at=None):
+        """Add a key, returning its expiry time (None if it was already present).
+
+        An explicit expires_at is only used to restore keys, in expiry order.
+        """
+        self.expire()
+        if key in self.expires:
+            return None
+        if expires_at is None:
+            expires_at = time.time() + self.ttl
+        self.expires[key] = expires_at
+        self.order.append((expires_at, key))
+
+        while len(self.expires) > self.max_size:
+            old_expires_at, old_key = self.order.popleft()
+            if self.expires.get(old_key) == old_expires_at:
+                del self.expires[old_key]
+                self.evicted += 1
+
+        return expires_at
+
+    def __contains__(self, key):
+        expires_at = self.expires.get(key)
+        return expires_at is not None and expires_at > time.time()
+
+    def __len__(self):
+        return len(self.expires)
 
 # Set to track processed message IDs to avoid duplicates
-# Structure: {chat_id: {message_id: timestamp}}
-processed_message_ids = {}
+# Keys: (chat_id, message_id, kind), kind being "cabinet", "cancellation" or "command"
+processed_message_ids = ExpiringIdSet(PROCESSED_IDS_TTL, PROCESSED_IDS_MAX)
+
+# Transaction cache to avoid processing the same transaction twice
+# Keys: (chat_id, transaction_id)
+transaction_cache = ExpiringIdSet(TRANSACTION_TTL, TRANSACTION_CACHE_MAX)
+
+class ChatCursors:
+    """High-water marks of ingested message ids per chat, backed by a JSON file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.cursors = {}
+        self.dirty = False
+
+    def load(self):
+        cursors = {}
+        try:
+            if self.path.exists():
+                with self.path.open("r", encoding="utf-8") as f:
+                    cursors = {int(chat_id): int(msg_id) for chat_id, msg_id in json.load(f).items()}
+        except Exception as e:
+            # The cursors only save work, start over and catch up from history
+            print(f"Error reading {self.path}, starting with no cursors: {e!r}")
+        self.cursors = cursors
+        self.dirty = False
+
+    def save(self):
+        """Write the cursors atomically if anything changed since the last save"""
+        if not self.dirty:
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump({str(chat_id): msg_id for chat_id, msg_id in self.cursors.items()}, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+
+    def get(self, chat_id):
+        return self.cursors.get(chat_id)
+
+    def advance(self, chat_id, message_id):
+        """Move the cursor forward (never backwards) to message_id"""
+        if message_id > self.cursors.get(chat_id, 0):
+            self.cursors[chat_id] = message_id
+            self.dirty = True
+
+# Structure: {chat_id: last_ingested_message_id}
+chat_cursors = ChatCursors(CURSORS_FILE)
+
+class ChatPollScheduler:
+    """Per-chat next-due times kept in a priority queue"""
+
+    def __init__(self, min_interval, max_interval, error_interval):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.error_interval = error_interval
+        self.heap = []        # [(due_time, chat_id)], may hold stale entries
+        self.due_times = {}   # {chat_id: due_time} - the authoritative schedule
+        self.intervals = {}   # {chat_id: current polling interval}
+        self.errors = {}      # {chat_id: consecutive failed polls}
+
+    def _schedule(self, chat_id, due_time):
+        self.due_times[chat_id] = due_time
+        heapq.heappush(self.heap, (due_time, chat_id))
+
+    def sync(self, chat_ids, now):
+        """Start tracking new chats (due immediately) and forget unlinked ones"""
+        for chat_id in chat_ids:
+            if chat_id not in self.due_times:
+                self.intervals[chat_id] = self.min_interval
+                self._schedule(chat_id, now)
+        for chat_id in list(self.due_times):
+            if chat_id not in chat_ids:
+                del self.due_times[chat_id]
+                self.intervals.pop(chat_id, None)
+                self.errors.pop(chat_id, None)
+
+    def pop_due(self, now):
+        """Remove and return every chat whose due time has passed"""
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            due_time, chat_id = heapq.heappop(self.heap)
+            # Skip entries superseded by a later reschedule or unlinked chats
+            if self.due_times.get(chat_id) == due_time:
+                del self.due_times[chat_id]
+                due.append(chat_id)
+        return due
+
+    def reschedule(self, chat_id, now, active=False, error=False):
+        """Put a polled chat back into the queue with an interval based on the outcome"""
+        interval = self.intervals.get(chat_id, self.min_interval)
+        if error:
+            # Back off only this chat, doubling up to the error ceiling
+            errors = self.errors[chat_id] = self.errors.get(chat_id, 0) + 1
+            interval = min(max(interval, self.min_interval) * 2, self.error_interval)
+            if errors % MONITOR_FAILING_AFTER == 0:
+                print(f"Chat {chat_id} failed {errors} polls in a row, next poll in {interval:.0f}s")
+        else:
+            self.errors.pop(chat_id, None)
+            if active:
+                interval = self.min_interval
+            else:
+                interval = min(interval * MONITOR_BACKOFF_FACTOR, self.max_interval)
+        self.intervals[chat_id] = interval
+        self._schedule(chat_id, now + interval)
+
+    def failing(self):
+        """Chats whose last MONITOR_FAILING_AFTER or more polls all failed"""
+        return {chat_id: errors for chat_id, errors in self.errors.items() if errors >= MONITOR_FAILING_AFTER}
+
+    def mark_active(self, chat_id, now):
+        """Pull a chat that just produced messages back to the shortest interval"""
+        if chat_id not in self.intervals:
+            return
+        self.intervals[chat_id] = self.min_interval
+        due_time = self.due_times.get(chat_id)
+        if due_time is not None and due_time > now + self.min_interval:
+            self._schedule(chat_id, now + self.min_interval)
+
+    def seconds_until_next(self, now):
+        """Time until the earliest scheduled poll, or None if nothing is scheduled"""
+        while self.heap and self.due_times.get(self.heap[0][1]) != self.heap[0][0]:
+            heapq.heappop(self.heap)
+        if not self.heap:
+            return None
+        return max(self.heap[0][0] - now, 0)
+
+poll_scheduler = ChatPollScheduler(MONITOR_MIN_INTERVAL, MONITOR_FALLBACK_INTERVAL, MONITOR_ERROR_INTERVAL)
+
+class SendLane:
+    """Outbound lane of one chat: sends through it are serialized"""
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.users = 0          # Requests holding or waiting for the lane
+        self.last_reply_id = 0  # Newest reply already attributed to a request
+
+# Sends to the same chat go one at a time so every reply belongs to exactly
+# one request, sends to different chats run in parallel
+# Structure: {chat_id: SendLane}
+send_lanes = {}
+
+@asynccontextmanager
+async def outbound_lane(chat_id):
+    """Hold the chat's outbound lane for the duration of one send"""
+    lane = send_lanes.setdefault(chat_id, SendLane())
+    lane.users += 1
+    try:
+        async with lane.lock:
+            yield lane
+    finally:
+        lane.users -= 1
+        # Keep last_reply_id only while someone might still need it
+        if lane.users == 0 and send_lanes.get(chat_id) is lane:
+            del send_lanes[chat_id]
+
+class PendingReply:
+    """Future for the reply to one outgoing /send message"""
+
+    def __init__(self, chat_id, lane):
+        self.chat_id = chat_id
+        self.lane = lane
+        self.sent_id = None
+        self.early = []  # Messages that arrived before send_message returned
+        self.candidate = None  # Error-only reply, held in case the confirmation follows
+        self.future = asyncio.get_running_loop().create_future()
+
+    def offer(self, msg):
+        """Resolve the future if msg is a reply to our message. Returns True if it was."""
+        if self.future.done() or msg.outgoing or not msg.text:
+            return False
+        if self.sent_id is None:
+            self.early.append(msg)
+            return False
+        # Ids grow monotonically within a chat, so anything at or below our
+        # own message was written before it, and anything at or below the
+        # lane's last reply was already given to an earlier request
+        if msg.id <= max(self.sent_id, self.lane.last_reply_id):
+            return False
+        # An explicit reply to some other message is not ours
+        if msg.reply_to_message_id is not None and msg.reply_to_message_id != self.sent_id:
+            return False
+        if msg.reply_to_message_id == self.sent_id:
+            self._resolve(msg)
+            return True
+        classification = classify_message(msg.text)
+        if not classification.is_reply:
+            return False
+        if classification.queued:
+            # The confirmation wins over an error-only message before it
+            self._resolve(msg)
+            return True
+        if self.candidate is None:
+            self.candidate = msg
+            asyncio.get_running_loop().call_later(SEND_ERROR_GRACE, self._settle)
+            return True
+        return False
+
+    def _resolve(self, msg):
+        self.lane.last_reply_id = max(self.lane.last_reply_id, msg.id)
+        self.future.set_result(msg)
+
+    def _settle(self):
+        """Accept the held error-only reply if nothing better came"""
+        if self.candidate is not None and not self.future.done():
+            self._resolve(self.candidate)
+
+    def set_sent(self, sent_id):
+        """Record our message id and re-check anything that arrived before it"""
+        self.sent_id = sent_id
+        early, self.early = self.early, []
+        for msg in early:
+            self.offer(msg)
+            if self.future.done():
+                break
+
+    async def wait(self, timeout):
+        """Wait for the reply, returning None if it doesn't arrive in time"""
+        try:
+            return await asyncio.wait_for(asyncio.shield(self.future), timeout)
+        except asyncio.TimeoutError:
+            self._settle()
+            return self.future.result() if self.future.done() else None
+
+# Replies awaited by /send requests
+# Structure: {chat_id: [PendingReply]}
+pending_replies = {}
+
+def register_pending_reply(chat_id, lane):
+    pending = PendingReply(chat_id, lane)
+    pending_replies.setdefault(chat_id, []).append(pending)
+    return pending
+
+def unregister_pending_reply(pending):
+    waiting = pending_replies.get(pending.chat_id, [])
+    if pending in waiting:
+        waiting.remove(pending)
+    if not waiting:
+        pending_replies.pop(pending.chat_id, None)
+
+def offer_pending_reply(msg):
+    """Hand an incoming message to the /send requests waiting in its chat"""
+    for pending in pending_replies.get(msg.chat.id, []):
+        if pending.offer(msg):
+            return True
+    return False
+
+class SendJob:
+    """A /send running in the background for POST /send/async"""
+
+    def __init__(self, chat_id, text):
+        self.job_id = uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.text = text
+        self.created_at = time.time()
+        self.finished_at = None
+        self.result = None
+        self.done = asyncio.Event()
+        self.task = None
+
+class JobStore:
+    """Send jobs by id; finished jobs expire JOB_RESULT_TTL seconds after finishing"""
+
+    def __init__(self, result_ttl):
+        self.result_ttl = result_ttl
+        self.jobs = {}
+        self.expiry = deque()  # (expires_at, job_id) in finishing order
+
+    def add(self, job):
+        self.expire()
+        self.jobs[job.job_id] = job
+
+    def get(self, job_id):
+        self.expire()
+        return self.jobs.get(job_id)
+
+    def finish(self, job, result):
+        job.result = result
+        job.finished_at = time.time()
+        job.done.set()
+        self.expiry.append((job.finished_at + self.result_ttl, job.job_id))
+
+    def expire(self):
+        """Drop finished jobs whose retention window has passed"""
+        now = time.time()
+        while self.expiry and self.expiry[0][0] <= now:
+            _, job_id = self.expiry.popleft()
+            self.jobs.pop(job_id, None)
+
+send_jobs = JobStore(JOB_RESULT_TTL)
+
+# Fire-and-forget tasks that must not be garbage collected while running
+background_tasks = set()
+
+class EventSubscriber:
+    """One event stream client with its own bounded buffer and filters"""
+
+    def __init__(self, cabinet_name=None, chat_id=None):
+        self.queue = asyncio.Queue(maxsize=EVENT_SUBSCRIBER_QUEUE)
+        self.cabinet_name = cabinet_name.lower() if cabinet_name else None
+        self.chat_id = chat_id
+        self.overflowed = False
+
+    def matches(self, event):
+        _, _, data = event
+        if self.chat_id is not None and data["chat_id"] != self.chat_id:
+            return False
+        # Cancellations carry no cabinet, so a cabinet filter excludes them
+        if self.cabinet_name is not None and (data.get("cabinet_name") or "").lower() != self.cabinet_name:
+            return False
+        return True
+
+class EventBroker:
+    """Fans accepted cabinet and cancellation messages out to stream subscribers"""
+
+    def __init__(self, buffer_size):
+        # Ids start from the boot time in ns so they keep increasing across
+        # restarts and a resuming client never holds an id from our future
+        self.next_id = time.time_ns()
+        self.buffer = deque(maxlen=buffer_size)  # [(event_id, event_type, data)]
+        self.subscribers = set()
+
+    def publish(self, event_type, data):
+        event = (self.next_id, event_type, data)
+        self.next_id += 1
+        self.buffer.append(event)
+
+        for subscriber in list(self.subscribers):
+            if not subscriber.matches(event):
+                continue
+            try:
+                subscriber.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Cut off slow consumers instead of buffering without limit,
+                # they can reconnect and resume from their last event id
+                subscriber.overflowed = True
+                self.subscribers.discard(subscriber)
+
+    def replay(self, last_event_id):
+        """Buffered events after last_event_id and whether some were already dropped"""
+        if last_event_id >= self.next_id:
+            # Not an id this broker handed out (clock moved back or a bogus
+            # header), so nothing can be trusted: replay everything we have
+            return list(self.buffer), True
+        oldest_id = self.buffer[0][0] if self.buffer else self.next_id
+        missed = last_event_id + 1 < oldest_id
+        return [event for event in self.buffer if event[0] > last_event_id], missed
+
+event_broker = EventBroker(EVENT_BUFFER_SIZE)
+
+class LinksRegistry:
+    """links.json kept in memory, reloaded only when the file's mtime changes.
+
+    Requests read the in-memory list and name map; the monitor calls
+    refresh() each cycle to pick up edits made outside the API. Writes go to
+    a temp file that is atomically renamed over links.json.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.links = []  # [{"id": chat_id, "name": name}] in link number order
+        self.names = {}  # {chat_id: name}, the chats watched by the update handler
+        self.mtime = None
+
+    def _set(self, links):
+        # Replaced wholesale, never mutated, so readers always see a consistent list
+        names = {link["id"]: link["name"] for link in links}
+        self.links = links
+        self.names = names
+
+    def refresh(self):
+        """Reload the file if it changed on disk since the last load or save"""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        if mtime is None:
+            self._set([])
+        else:
+            try:
+                with self.path.open("r", encoding="utf-8") as f:
+                    self._set(json.load(f))
+            except ValueError as e:
+                # Possibly caught mid-write by an editor, retry on the next refresh
+                print(f"Error reading {self.path}: {e}")
+                return
+            except Exception as e:
+                # A file of the wrong shape keeps the current links; remember
+                # its mtime so it's parsed again only once it changes
+                print(f"Error reading {self.path}: {e!r}")
+        self.mtime = mtime
+
+    def save(self, links):
+        tmp_path = self.path.with_suffix(".tmp")
+        with tmp_path.open("w", encoding="utf-8") as f:
+            json.dump(links, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+        self._set(links)
+        self.mtime = self.path.stat().st_mtime_ns
+
+    def add(self, chat_id, name):
+        # Start from the file as it is now, not as the monitor last saw it
+        self.refresh()
+        self.save(self.links + [{"id": chat_id, "name": name}])
+
+    def delete(self, idx):
+        self.refresh()
+        if not 0 <= idx < len(self.links):
+            return False
+        self.save(self.links[:idx] + self.links[idx + 1:])
+        return True
+
+links_registry = LinksRegistry(LINKS_FILE)
 
 # Command regexes for bot functionality
 CMD_LINK = re.compile(r"#link\s+(.+)", re.I)
@@ -89,19 +1653,17 @@ async def handle_bot_messages():
                 # Process messages in Saved Messages (from self)
                 async for message in client.get_chat_history("me", limit=10):
                     # Skip already processed messages
-                    if message.chat.id in processed_message_ids and message.id in processed_message_ids[message.chat.id]:
+                    if (message.chat.id, message.id, "command") in processed_message_ids:
                         continue
 
                     # Track this message as processed
-                    if message.chat.id not in processed_message_ids:
-                        processed_message_ids[message.chat.id] = {}
-                    processed_message_ids[message.chat.id][message.id] = time.time()
+                    processed_message_ids.add((message.chat.id, message.id, "command"))
 
                     # Process only text messages
                     if message.text:
                         # Process #list command
                         if message.text.lower().strip() == "#list":
-                            links = load_links()
+                            links = links_registry.links
                             msg = "\n".join(f"{i+1}. {l['name']}  (ID {l['id']})"
                                            for i, l in enumerate(links)) or "No links found."
                             await client.send_message("me", msg)
@@ -186,87 +1748,256 @@ async def handle_bot_messages():
         # Wait before next check
         await asyncio.sleep(polling_interval)
 
+def ingest_message(chat_id, chat_name, text, timestamp, message_id=None):
+    """Single ingest point for linked-chat messages from every source.
+
+    The update handler, the catch-up poll and the /send history fallback all
+    push messages here. The text is classified once, each (chat, message id,
+    kind) is accepted once, and the entry is dispatched to the stores for
+    its kind. Returns True if anything new was stored.
+    """
+    classification = classify_message(text)
+    kinds = []
+    if classification.kind == "cabinet":
+        kinds.append("cabinet")
+    if classification.cancellation:
+        # A cabinet message can be a cancellation too, it is stored as both
+        kinds.append("cancellation")
+
+    stored = False
+    for kind in kinds:
+        if message_id is not None:
+            key = (chat_id, message_id, kind)
+            if key in processed_message_ids:
+                continue
+            processed_message_ids.add(key)
+        INGEST_HANDLERS[kind](chat_id, text, timestamp, chat_name, message_id, classification)
+        print(f"Found {kind} message in chat {chat_name} (ID: {message_id})")
+        stored = True
+    return stored
+
+def ingest_linked_message(chat_id, chat_name, msg):
+    """Push a Pyrogram message from a linked chat through ingest_message"""
+    if not msg.text:
+        return False
+    # Convert Pyrogram date to timestamp
+    timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
+    return ingest_message(chat_id, chat_name, msg.text, timestamp, message_id=msg.id)
+
+async def iter_messages_after(chat_id, after_id):
+    """Page forward from after_id, yielding lists of newer messages oldest first"""
+    peer = await client.resolve_peer(chat_id)
+    while True:
+        # offset_id + negative add_offset walks towards newer messages,
+        # min_id guarantees nothing at or below the cursor comes back
+        result = await client.invoke(
+            raw.functions.messages.GetHistory(
+                peer=peer,
+                offset_id=after_id + 1,
+                offset_date=0,
+                add_offset=-HISTORY_PAGE_SIZE,
+                limit=HISTORY_PAGE_SIZE,
+                max_id=0,
+                min_id=after_id,
+                hash=0
+            ),
+            sleep_threshold=60
+        )
+        page = await utils.parse_messages(client, result, replies=0)
+        page = sorted((m for m in page if m and m.id > after_id), key=lambda m: m.id)
+        if not page:
+            return
+
+        yield page
+
+        after_id = page[-1].id
+        if len(result.messages) < HISTORY_PAGE_SIZE:
+            return
+
+async def poll_linked_chat(chat_id, chat_name):
+    """Ingest everything newer than the chat's cursor and advance the cursor.
+
+    Returns the number of cabinet and cancellation messages stored.
+    """
+    cursor = chat_cursors.get(chat_id)
+    hits = 0
+
+    if cursor is None:
+        # First time we see this chat: start from its latest messages
+        messages = [msg async for msg in client.get_chat_history(chat_id, limit=BOOTSTRAP_HISTORY_LIMIT) if msg]
+        messages.reverse()
+        for msg in messages:
+            hits += ingest_linked_message(chat_id, chat_name, msg)
+            chat_cursors.advance(chat_id, msg.id)
+        return hits
+
+    async for page in iter_messages_after(chat_id, cursor):
+        for msg in page:
+            if not msg.empty:
+                hits += ingest_linked_message(chat_id, chat_name, msg)
+            chat_cursors.advance(chat_id, msg.id)
+    return hits
+
+def chat_display_name(chat):
+    """Name used for a chat in stored messages: link name, title or user name"""
+    if chat.id in links_registry.names:
+        return links_registry.names[chat.id]
+    if chat.title:
+        return chat.title
+    if chat.first_name:
+        return f"User {chat.first_name}"
+    return str(chat.id)
+
+# Update handler for linked chats and chats with a /send awaiting its reply -
+# messages are ingested as Telegram pushes them
+def _is_watched_chat(_, __, message):
+    return message.chat is not None and (
+        message.chat.id in links_registry.names or message.chat.id in pending_replies
+    )
+
+watched_chat_filter = filters.create(_is_watched_chat)
+
+@client.on_message(watched_chat_filter)
+async def on_chat_message(_, message):
+    """Resolve pending /send replies and ingest new messages as soon as they arrive"""
+    chat_id = message.chat.id
+    offer_pending_reply(message)
+
+    if ingest_linked_message(chat_id, chat_display_name(message.chat), message):
+        poll_scheduler.mark_active(chat_id, time.monotonic())
+
+    # Only move the cursor over a contiguous run of ids, any gap is left
+    # for the catch-up poll to fill in
+    if chat_cursors.get(chat_id) == message.id - 1:
+        chat_cursors.advance(chat_id, message.id)
+
+async def fetch_top_message_ids(chat_ids):
+    """Get the newest message id of each chat's dialog in bulk.
+
+    Returns {chat_id: top_message_id} for every chat Telegram reported on.
+    """
+    top_ids = {}
+    peers = []
+    for chat_id in chat_ids:
+        try:
+            peers.append(raw.types.InputDialogPeer(peer=await client.resolve_peer(chat_id)))
+        except Exception as e:
+            # Left out here, the chat will be fetched directly and report its own error
+            print(f"Could not resolve chat {chat_id} for change detection: {e}")
+
+    for i in range(0, len(peers), PEER_DIALOGS_BATCH):
+        result = await client.invoke(
+            raw.functions.messages.GetPeerDialogs(peers=peers[i:i + PEER_DIALOGS_BATCH])
+        )
+        for dialog in result.dialogs:
+            if isinstance(dialog, raw.types.Dialog):
+                top_ids[utils.get_peer_id(dialog.peer)] = dialog.top_message
+    return top_ids
+
+async def detect_changed_chats(chat_ids):
+    """Split due chats into those with messages past their cursor and quiet ones.
+
+    Falls back to treating every chat as changed if detection fails.
+    """
+    try:
+        async with asyncio.timeout(10):
+            top_ids = await fetch_top_message_ids(chat_ids)
+    except Exception as e:
+        print(f"Change detection failed, fetching all due chats: {e}")
+        return list(chat_ids), []
+
+    changed, unchanged = [], []
+    for chat_id in chat_ids:
+        cursor = chat_cursors.get(chat_id)
+        top_id = top_ids.get(chat_id)
+        if cursor is None or top_id is None or top_id > cursor:
+            changed.append(chat_id)
+        else:
+            unchanged.append(chat_id)
+    return changed, unchanged
+
+async def check_linked_chat(chat_id, chat_name, semaphore):
+    """Catch up a single linked chat, logging (not raising) any errors.
+
+    Returns a (hits, ok) tuple used to reschedule the chat.
+    """
+    async with semaphore:
+        try:
+            # Catch up from the chat's cursor with timeout protection
+            try:
+                # Use a timeout to prevent hanging if there's an issue,
+                # pages processed before it fires keep their progress
+                async with asyncio.timeout(10):  # 10 second timeout
+                    return await poll_linked_chat(chat_id, chat_name), True
+            except asyncio.TimeoutError:
+                print(f"Timeout while getting messages from chat {chat_id} ({chat_name})")
+            except KeyError as ke:
+                print(f"Unrecognized Telegram constructor: {ke}")
+                print("This may be due to a Telegram API update or communication issue")
+            except ValueError as ve:
+                if "unknown constructor" in str(ve).lower():
+                    print(f"Unrecognized Telegram constructor: {ve}")
+                    print("This may be due to a Telegram API update or communication issue")
+                else:
+                    raise
+        except Exception as e:
+            print(f"Error checking chat {chat_id} ({chat_name}): {e}")
+        return 0, False
+
 # Background monitoring task
 async def monitor_linked_chats():
     """Background task to monitor linked chats for new messages"""
     print("Starting chat monitoring background task...")
 
-    # Set polling interval (in seconds)
-    polling_interval = 5
+    # This is only the catch-up path, new messages are normally delivered by
+    # on_chat_message. Each chat is polled on its own schedule.
     consecutive_errors = 0
     max_consecutive_errors = 5
+    fetch_semaphore = asyncio.Semaphore(MONITOR_CONCURRENCY)
 
     while True:
+        # Wait until the next chat is due unless something goes wrong
+        sleep_time = MONITOR_MIN_INTERVAL
+
         try:
             if client.is_connected:
                 # Get all linked chats
-                links = load_links()
+                links_registry.refresh()
+                response_rules.refresh()
+                links = links_registry.links
+                poll_scheduler.sync(links_registry.names, time.monotonic())
+
                 if not links:
                     print("No linked chats found. Waiting...")
                 else:
-                    print(f"Checking {len(links)} linked chats for new messages...")
-
-                    for link in links:
-                        chat_id = link["id"]
-                        chat_name = link["name"]
-
-                        try:
-                            # Get recent messages from this chat with timeout protection
-                            messages = []
-                            try:
-                                # Use a timeout to prevent hanging if there's an issue
-                                async with asyncio.timeout(10):  # 10 second timeout
-                                    async for msg in client.get_chat_history(chat_id, limit=10):
-                                        if not msg:
-                                            continue
-                                            
-                                        messages.append(msg)
-
-                                        if msg.text:
-                                            # Convert Pyrogram date to timestamp
-                                            timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
-                                            
-                                            # Check for cabinet messages
-                                            if "[" in msg.text and "]" in msg.text and ":" in msg.text:
-                                                # Parse and store cabinet message with message ID
-                                                parsed = parse_cabinet_message(
-                                                    chat_id,
-                                                    msg.text,
-                                                    timestamp,
-                                                    chat_name,
-                                                    message_id=msg.id
-                                                )
-                                                if parsed:
-                                                    print(f"Found cabinet message in chat {chat_name} (ID: {msg.id})")
-                                            
-                                            # Check for cancellation messages containing "невозможно обработать"
-                                            cancellation = process_cancellation_message(
-                                                chat_id,
-                                                msg.text,
-                                                timestamp,
-                                                chat_name,
-                                                message_id=msg.id
-                                            )
-                                            if cancellation:
-                                                print(f"Found cancellation message in chat {chat_name} (ID: {msg.id})")
-                            except asyncio.TimeoutError:
-                                print(f"Timeout while getting messages from chat {chat_id} ({chat_name})")
-                            except KeyError as ke:
-                                print(f"Unrecognized Telegram constructor: {ke}")
-                                print("This may be due to a Telegram API update or communication issue")
-                            except ValueError as ve:
-                                if "unknown constructor" in str(ve).lower():
-                                    print(f"Unrecognized Telegram constructor: {ve}")
-                                    print("This may be due to a Telegram API update or communication issue")
-                                else:
-                                    raise
-                            
-                            # Reset consecutive errors counter on success
-                            consecutive_errors = 0
-                                
-                        except Exception as e:
-                            print(f"Error checking chat {chat_id} ({chat_name}): {e}")
-                            continue
+                    due_chats = poll_scheduler.pop_due(time.monotonic())
+                    if due_chats:
+                        # One bulk request tells us which chats moved past their cursor
+                        changed_chats, unchanged_chats = await detect_changed_chats(due_chats)
+                        print(f"Checking {len(changed_chats)} of {len(due_chats)} due linked chats for new messages...")
+
+                        # Fetch chats concurrently, bounded by the semaphore, so the
+                        # cycle takes as long as the slowest chat instead of the sum
+                        results = await asyncio.gather(*(
+                            check_linked_chat(chat_id, links_registry.names.get(chat_id, ""), fetch_semaphore)
+                            for chat_id in changed_chats
+                        ))
+
+                        # Reschedule each chat based on its own outcome
+                        now = time.monotonic()
+                        for chat_id, (hits, ok) in zip(changed_chats, results):
+                            poll_scheduler.reschedule(chat_id, now, active=hits > 0, error=not ok)
+                        for chat_id in unchanged_chats:
+                            poll_scheduler.reschedule(chat_id, now)
+
+                        # Persist cursors so a restart resumes from here
+                        chat_cursors.save()
+
+                # Reset consecutive errors counter on success
+                consecutive_errors = 0
+
+                next_due = poll_scheduler.seconds_until_next(time.monotonic())
+                sleep_time = MONITOR_FALLBACK_INTERVAL if next_due is None else min(next_due, MONITOR_FALLBACK_INTERVAL)
             else:
                 print("Client not connected. Attempting to reconnect...")
                 try:
@@ -278,28 +2009,37 @@ async def monitor_linked_chats():
         except Exception as e:
             print(f"Error in monitoring task: {e}")
             consecutive_errors += 1
-            
-            # If we have too many consecutive errors, increase the polling interval
-            if consecutive_errors >= max_consecutive_errors:
-                old_interval = polling_interval
-                polling_interval = min(polling_interval * 2, 60)  # Max 60 seconds
-                if old_interval != polling_interval:
-                    print(f"Too many consecutive errors. Increasing polling interval to {polling_interval}s")
-                
-                # Try to restart the client if we're having persistent issues
-                if consecutive_errors >= max_consecutive_errors * 2:
-                    print("Attempting to restart Telegram client due to persistent errors...")
-                    try:
-                        if client.is_connected:
-                            await client.stop()
-                        await client.start()
-                        print("Client restart successful")
-                        consecutive_errors = 0
-                    except Exception as restart_error:
-                        print(f"Client restart failed: {restart_error}")
+
+            # Try to restart the client if we're having persistent issues
+            if consecutive_errors >= max_consecutive_errors * 2:
+                print("Attempting to restart Telegram client due to persistent errors...")
+                try:
+                    if client.is_connected:
+                        await client.stop()
+                    await client.start()
+                    print("Client restart successful")
+                    consecutive_errors = 0
+                except Exception as restart_error:
+                    print(f"Client restart failed: {restart_error}")
 
         # Wait before next check
-        await asyncio.sleep(polling_interval)
+        await asyncio.sleep(max(sleep_time, 1))
+
+# Background housekeeping task
+async def housekeeping():
+    """Periodically age out stored messages in chats that receive nothing new"""
+    while True:
+        await asyncio.sleep(HOUSEKEEPING_INTERVAL)
+        try:
+            now = time.time()
+            message_history.expire(now)
+            cancellation_messages.expire(now)
+            processed_message_ids.expire(now)
+            transaction_cache.expire(now)
+            payout_index.expire(now)
+            payout_tracker.expire(now)
+        except Exception as e:
+            print(f"Error in housekeeping task: {e}")
 
 # Lifespan context manager
 @asynccontextmanager
@@ -308,8 +2048,27 @@ async def lifespan(app: FastAPI):
     print("Starting Telegram client...")
     monitoring_task = None
     message_handler_task = None
+    housekeeping_task = asyncio.create_task(housekeeping())
+    event_store_task = None
     global MY_ID
 
+    # Load the links first, the update handler watches them from the start
+    try:
+        links_registry.refresh()
+    except Exception as e:
+        print(f"Error loading links from {LINKS_FILE}: {e}")
+    response_rules.refresh()
+    chat_cursors.load()
+
+    # Restore stored messages before anything new comes in
+    try:
+        await load_event_store()
+        event_store_task = asyncio.create_task(flush_event_store())
+    except Exception as e:
+        print(f"Error opening event store {EVENT_STORE_FILE}: {e}")
+        print("Messages will only be kept in memory")
+        event_store.close()
+
     try:
         await client.start()
         print("Telegram client started successfully")
@@ -319,7 +2078,7 @@ async def lifespan(app: FastAPI):
         MY_ID = me.id
         print(f"Bot user ID: {MY_ID}")
 
-        # Start background monitoring task
+        # Start background monitoring task (catch-up polling)
         monitoring_task = asyncio.create_task(monitor_linked_chats())
         print("Background monitoring task started")
 
@@ -344,6 +2103,13 @@ async def lifespan(app: FastAPI):
         except asyncio.CancelledError:
             print("Monitoring task cancelled")
 
+    # Cancel housekeeping task
+    housekeeping_task.cancel()
+    try:
+        await housekeeping_task
+    except asyncio.CancelledError:
+        print("Housekeeping task cancelled")
+
     # Cancel message handler task if running
     if message_handler_task:
         message_handler_task.cancel()
@@ -355,6 +2121,22 @@ async def lifespan(app: FastAPI):
     if client.is_connected:
         await client.stop()
 
+    # Keep cursors advanced by the update handler since the last poll
+    chat_cursors.save()
+
+    # Write out the last batch of messages
+    if event_store_task:
+        event_store_task.cancel()
+        try:
+            await event_store_task
+        except asyncio.CancelledError:
+            pass
+        try:
+            await event_store.flush()
+        except Exception as e:
+            print(f"Error writing to event store: {e}")
+        event_store.close()
+
     print("Telegram client stopped successfully")
 
 # Create FastAPI app with lifespan
@@ -368,7 +2150,7 @@ app = FastAPI(
     When sending messages through the /send endpoint, the API will:
 
     1. Send your message to the specified chat
-    2. Wait 10 seconds for a response
+    2. Wait for the reply to be delivered (up to SEND_REPLY_TIMEOUT seconds, with a chat history check as fallback)
     3. Check the response message for specific patterns
 
     ### Success/Failure Detection
@@ -376,6 +2158,18 @@ app = FastAPI(
     - If the response contains "Exception: params count", the API returns failure status
     - If the response contains "Выплата добавлена в очередь", the API returns success status
 
+    ### Async Mode
+
+    **POST /send/async** takes the same body but returns a job id right away.
+    **GET /jobs/{job_id}?wait=N** returns the job, waiting up to N seconds for
+    it to finish; its `result` is the same response /send would have returned.
+
+    ### Batch Mode
+
+    **POST /send/batch** takes `{"items": [{"chat_id": ..., "text": ...}, ...]}`
+    and streams one NDJSON line per item as it completes. Different chats are
+    processed concurrently, the same chat in order.
+
     ### Auto-Withdraw Detection
 
     For payment messages, the API will parse and return the auto-withdraw status:
@@ -383,9 +2177,16 @@ app = FastAPI(
     - "Автовывод: ДА" - auto_withdraw field is set to true
     - "Автовывод: НЕТ" - auto_withdraw field is set to false
 
+    ### Response Rules
+
+    The phrases and fields used to classify replies, cabinet messages and
+    cancellations can be overridden in RESPONSE_RULES_FILE (same structure as
+    DEFAULT_RESPONSE_RULES). Changes are picked up without a restart.
+
     ## Cabinet Message Tracking
 
-    The API automatically tracks cabinet messages in the format:
+    The API automatically tracks cabinet messages in linked chats as they arrive
+    (with a low-frequency history poll as catch-up) in the format:
 
     ```
     [cabinet_name#cabinet_id] Автоматическое оповещение: Message content
@@ -396,7 +2197,9 @@ app = FastAPI(
     ### Cabinet Message Endpoints
 
     - **GET /messages/recent** - Get cabinet messages from the last 3 hours (or custom time period)
-    - **GET /messages/all** - Get all cabinet messages collected since the API started
+    - **GET /messages/all** - Get all stored cabinet messages
+
+    Both accept `cabinet_name`, `cabinet_id` and `chat_id` filters.
 
     ## Cancellation Message Tracking
 
@@ -405,9 +2208,41 @@ app = FastAPI(
     ### Cancellation Message Endpoints
     
     - **GET /cancellations/recent** - Get cancellation messages from the last 24 hours
-    - **GET /cancellations/all** - Get all cancellation messages collected since the API started
+    - **GET /cancellations/all** - Get all stored cancellation messages
+
+    Messages are stored in a local SQLite database (EVENT_STORE_FILE) and survive
+    restarts. Recent windows are served from memory.
 
     Messages are returned in reverse chronological order (newest first).
+
+    ### Pagination and Sync
+
+    The `/all` endpoints accept `limit` and keyset cursors: pass `next_cursor`
+    back as `before` for the next (older) page, or use `after` to page forward.
+    Every response carries a `sync_cursor`; pass it as `since` to get only the
+    records stored after that response.
+
+    ## Payout Status
+
+    **GET /payouts/{payout_id}** returns the latest status of a payout
+    (`Выплата#2259417 в обработке` reports status "в обработке" for 2259417)
+    and the timeline of its status updates from cabinet messages.
+
+    Payouts also move through a lifecycle as /send confirmations, cabinet
+    updates and cancellations arrive: `sent`, `queued`, `processing`, then
+    `completed` or `cancelled`. The response includes the current state, the
+    time spent in it and the end-to-end latency once finished. A message
+    naming both a `Выплата#` and a `Транзакция#` id links them, after which
+    either id finds the payout.
+    **GET /payouts/stuck** lists open payouts that haven't changed state for
+    `older_than` seconds (default PAYOUT_STUCK_AFTER).
+
+    ## Event Stream
+
+    **GET /events/stream** pushes each new cabinet and cancellation message as
+    a Server-Sent Event the moment it is stored, filtered by `cabinet_name`
+    and/or `chat_id`. Reconnect with `last_event_id` (or the `Last-Event-ID`
+    header) to resume without losing events.
     """,
     lifespan=lifespan
 )
@@ -450,6 +2285,46 @@ class MessageResponse(BaseModel):
     success: bool
     message: str
     auto_withdraw: Optional[bool] = None
+    transaction_id: Optional[str] = None
+
+class BatchSendRequest(BaseModel):
+    items: List[Message]
+
+class BatchSendResult(MessageResponse):
+    index: int
+    chat_id: int
+
+class JobStatus(BaseModel):
+    job_id: str
+    status: str
+    created_at: float
+    finished_at: Optional[float] = None
+    result: Optional[MessageResponse] = None
+
+class PayoutEvent(BaseModel):
+    status: str
+    timestamp: float
+    chat_id: int
+    cabinet_name: str
+    cabinet_id: str
+    message_id: Optional[int] = None
+
+class PayoutState(BaseModel):
+    payout_id: str
+    chat_id: Optional[int] = None
+    state: str  # sent, queued, processing, completed or cancelled
+    status: Optional[str] = None  # Latest cabinet status text
+    started_at: float
+    state_since: float
+    time_in_state: float
+    latency: Optional[float] = None  # First event to completion or cancellation
+
+class PayoutStatus(PayoutState):
+    updated_at: float
+    timeline: List[PayoutEvent]
+
+class PayoutList(BaseModel):
+    payouts: List[PayoutState]
 
 class CabinetMessage(BaseModel):
     chat_id: int
@@ -462,6 +2337,8 @@ class CabinetMessage(BaseModel):
 
 class CabinetMessageList(BaseModel):
     messages: List[CabinetMessage]
+    next_cursor: Optional[str] = None  # Pass as before/after for the next page
+    sync_cursor: Optional[int] = None  # Pass as since to get only newer records
 
 class CancellationMessage(BaseModel):
     chat_id: int
@@ -472,146 +2349,93 @@ class CancellationMessage(BaseModel):
 
 class CancellationMessageList(BaseModel):
     messages: List[CancellationMessage]
+    next_cursor: Optional[str] = None
+    sync_cursor: Optional[int] = None
 
 # Helper functions
-def load_links():
-    if LINKS_FILE.exists():
-        with LINKS_FILE.open("r", encoding="utf-8") as f:
-            return json.load(f)
-    return []
-
-def save_links(data):
-    with LINKS_FILE.open("w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
-
 def add_link(chat_id: int, name: str):
-    links = load_links()
-    links.append({"id": chat_id, "name": name})
-    save_links(links)
+    links_registry.add(chat_id, name)
     return True
 
 def delete_link(idx: int):
-    links = load_links()
-    if 0 <= idx < len(links):
-        links.pop(idx)
-        save_links(links)
-        return True
-    return False
+    return links_registry.delete(idx)
 
-def parse_cabinet_message(chat_id, text, timestamp, chat_name="", message_id=None):
-    """Parse cabinet message and store in message history"""
+def parse_cabinet_message(chat_id, text, timestamp, chat_name="", message_id=None, classification=None):
+    """Store a cabinet message in message history; duplicates are filtered by ingest_message"""
     # Parse message like: [redisonpay#947] Автоматическое оповещение: Message content
-    # Using a different regex approach to better capture the full message after the colon
-    cabinet_match = re.match(r'\[([\w]+)#(\d+)\]\s+([^:]+):(.*)', text)
+    classification = classification or classify_message(text)
 
-    if cabinet_match:
-        cabinet_name = cabinet_match.group(1)
-        cabinet_id = cabinet_match.group(2)
+    if classification.kind == "cabinet":
+        cabinet_name = classification.cabinet_name
+        cabinet_id = classification.cabinet_id
 
-        # Extract the full message content after the colon
-        prefix_part = f"[{cabinet_name}#{cabinet_id}] {cabinet_match.group(3)}:"
-        message_content = text[len(prefix_part):].strip()
+        # The full message content after the header's colon
+        message_content = classification.content
 
         # Print for debugging
         print(f"Parsed message content: '{message_content}'")
 
-        # If the regex failed to capture message content properly, try another approach
-        if not message_content and ":" in text:
-            colon_pos = text.find(":")
-            if colon_pos > 0:
-                message_content = text[colon_pos+1:].strip()
-                print(f"Alternative parsing used, message content: '{message_content}'")
-
-        # Check if this message ID has already been processed
-        if message_id is not None:
-            # Initialize chat in processed IDs if not exists
-            if chat_id not in processed_message_ids:
-                processed_message_ids[chat_id] = {}
-
-            # If this message ID is already in our processed set, skip it
-            if message_id in processed_message_ids[chat_id]:
-                print(f"Skipping already processed message ID {message_id}")
-                return None
-
-            # Add to processed messages
-            processed_message_ids[chat_id][message_id] = timestamp
-
         # Create message entry
-        message_entry = {
-            "cabinet_name": cabinet_name,
-            "cabinet_id": cabinet_id,
-            "message": message_content,
-            "timestamp": timestamp,
-            "chat_id": chat_id,
-            "chat_name": chat_name,
-            "message_id": message_id
-        }
-
-        # Initialize chat in history if not exists
-        if chat_id not in message_history:
-            message_history[chat_id] = []
+        message_entry = CabinetRecord.create(
+            cabinet_name=cabinet_name,
+            cabinet_id=cabinet_id,
+            message=message_content,
+            timestamp=timestamp,
+            chat_id=chat_id,
+            chat_name=chat_name,
+            message_id=message_id
+        )
 
-        # Add message to history
-        message_history[chat_id].append(message_entry)
+        # Add message to history and queue it for the event store
+        message_history.add(message_entry)
+        event_store.append("cabinet", message_entry)
+        index_payout(classification, message_entry)
 
         print(f"Added cabinet message: {cabinet_name}#{cabinet_id} - {message_content[:30]}...")
 
-        # Clean old processed message IDs (older than 24 hours)
-        current_time = time.time()
-        for chat in list(processed_message_ids.keys()):
-            for msg_id in list(processed_message_ids[chat].keys()):
-                if current_time - processed_message_ids[chat][msg_id] > 86400:  # 24 hours
-                    del processed_message_ids[chat][msg_id]
+        # Push to event stream subscribers
+        event_broker.publish("cabinet", message_entry)
 
         return message_entry
 
     return None
 
-def process_cancellation_message(chat_id, text, timestamp, chat_name="", message_id=None):
-    """Process and store cancellation messages containing 'невозможно обработать'"""
-    # Case-insensitive pattern matching for "невозможно обработать"
-    cancellation_pattern = re.compile(r"невозможно\s+обработать", re.IGNORECASE)
-    
-    # Check if the message contains the pattern
-    if cancellation_pattern.search(text):
+def process_cancellation_message(chat_id, text, timestamp, chat_name="", message_id=None, classification=None):
+    """Store a cancellation message containing 'невозможно обработать'; duplicates are filtered by ingest_message"""
+    # Case-insensitive match for "невозможно обработать", found by the classifier
+    classification = classification or classify_message(text)
+    if classification.cancellation:
         print(f"Found cancellation message: '{text[:50]}...'")
-        
-        # Check if this message ID has already been processed
-        if message_id is not None:
-            # Initialize chat in processed IDs if not exists
-            if chat_id not in processed_message_ids:
-                processed_message_ids[chat_id] = {}
-
-            # If this message ID is already in our processed set, skip it
-            if message_id in processed_message_ids[chat_id]:
-                print(f"Skipping already processed cancellation message ID {message_id}")
-                return None
-
-            # Add to processed messages
-            processed_message_ids[chat_id][message_id] = timestamp
 
         # Create message entry
-        message_entry = {
-            "message": text,
-            "timestamp": timestamp,
-            "chat_id": chat_id,
-            "chat_name": chat_name,
-            "message_id": message_id
-        }
-
-        # Initialize chat in cancellation messages if not exists
-        if chat_id not in cancellation_messages:
-            cancellation_messages[chat_id] = []
+        message_entry = CancellationRecord.create(
+            message=text,
+            timestamp=timestamp,
+            chat_id=chat_id,
+            chat_name=chat_name,
+            message_id=message_id
+        )
 
-        # Add message to cancellation messages
-        cancellation_messages[chat_id].append(message_entry)
+        # Add message to cancellation messages and queue it for the event store
+        cancellation_messages.add(message_entry)
+        event_store.append("cancellation", message_entry)
+        track_cancellation(classification, message_entry)
         
         print(f"Added cancellation message from {chat_name}: {text[:30]}...")
-        
+
+        # Push to event stream subscribers
+        event_broker.publish("cancellation", message_entry)
+
         return message_entry
         
     return None
 
+# Stores each ingested message kind is dispatched to
+INGEST_HANDLERS = {
+    "cabinet": parse_cabinet_message,
+    "cancellation": process_cancellation_message,
+}
+
 async def get_api_key(api_key_header: str = Security(api_key_header)):
     if api_key_header == api_key:
         return api_key_header
@@ -625,6 +2449,43 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
 async def root():
     return {"status": "running", "message": "Telegram Bot API is running"}
 
+@app.get("/stats", tags=["Status"])
+async def get_stats(api_key: APIKey = Depends(get_api_key)):
+    """
+    Get storage statistics.
+
+    Returns:
+        Number of stored cabinet and cancellation messages and how many were
+        evicted by the age and per-chat count retention limits, the size
+        of the processed message id set, the event store's write backlog,
+        and the linked chats whose polls keep failing
+    """
+    return {
+        "messages": message_history.stats(),
+        "cancellations": cancellation_messages.stats(),
+        "processed_ids": {
+            "tracked": len(processed_message_ids),
+            "evicted_by_size": processed_message_ids.evicted
+        },
+        "transactions": {
+            "tracked": len(transaction_cache),
+            "evicted_by_size": transaction_cache.evicted
+        },
+        "payouts": {
+            "tracked": len(payout_tracker),
+            "with_status_updates": len(payout_index),
+            "open": len(payout_tracker.open)
+        },
+        "event_store": {
+            "pending": len(event_store.pending),
+            "dropped": event_store.dropped
+        },
+        "polling": {
+            "chats": len(poll_scheduler.intervals),
+            "failing": poll_scheduler.failing()
+        }
+    }
+
 @app.get("/links", response_model=ChatList, tags=["Links"])
 async def get_links(api_key: APIKey = Depends(get_api_key)):
     """
@@ -633,7 +2494,7 @@ async def get_links(api_key: APIKey = Depends(get_api_key)):
     Returns:
         List of all links with their ids and names
     """
-    links = load_links()
+    links = links_registry.links
     return ChatList(chats=[ChatLink(id=link["id"], name=link["name"]) for link in links])
 
 @app.post("/links", response_model=MessageResponse, tags=["Links"])
@@ -687,259 +2548,195 @@ async def delete_link_endpoint(request: LinkDeleteRequest, api_key: APIKey = Dep
 
 @app.get("/chats", response_model=ChatList, tags=["Chats"])
 async def get_chats(api_key: APIKey = Depends(get_api_key)):
-    links = load_links()
+    links = links_registry.links
     return ChatList(chats=[ChatLink(id=link["id"], name=link["name"]) for link in links])
 
-@app.post("/send", response_model=MessageResponse, tags=["Messages"])
-async def send_message(
-    message: Message,
-    api_key: APIKey = Depends(get_api_key)
-):
+async def find_reply_in_history(chat_id, sent_id, lane):
+    """Fallback for replies the update handler didn't deliver: read recent history.
+
+    Every message read is ingested, and the reply is the payment confirmation
+    newer than our message if there is one, else the newest incoming message.
+    Replies already attributed to earlier sends in the lane are skipped, and
+    so are cabinet notifications that don't explicitly reply to our message.
     """
-    Send a message to a Telegram chat and analyze the response.
+    min_id = max(sent_id, lane.last_reply_id)
+    replies = []
+    async for msg in client.get_chat_history(chat_id, limit=SEND_HISTORY_LIMIT):
+        if not msg:
+            continue
+        ingest_linked_message(chat_id, chat_display_name(msg.chat), msg)
+        if msg.id > min_id and not msg.outgoing and msg.text:
+            if msg.reply_to_message_id == sent_id:
+                replies.append(msg)
+            elif msg.reply_to_message_id is None and classify_message(msg.text).kind != "cabinet":
+                replies.append(msg)
+
+    print(f"Found {len(replies)} messages after our sent message")
+
+    # History is newest first
+    reply = None
+    for msg in replies:
+        if classify_message(msg.text).queued:
+            reply = msg
+            break
+    if reply is None and replies:
+        reply = replies[0]
+    if reply is not None:
+        lane.last_reply_id = max(lane.last_reply_id, reply.id)
+    return reply
+
+def analyze_response(chat_id, text):
+    """Turn the payment bot's reply into a MessageResponse"""
+    success = False
+    auto_withdraw = None
+    txn_id = None
+
+    # Log the actual message for debugging
+    print(f"Analyzing response message: {text}")
+    classification = classify_message(text)
+
+    # Check for error messages
+    if classification.error_message:
+        success = False
+        response_text = classification.error_message
+
+    # Check for success message with transaction details
+    elif classification.queued:
+        success = True
+        response_text = "Payment successfully queued"
+
+        # Transaction details
+        if classification.transaction_id:
+            txn_id = classification.transaction_id
+            print(f"Transaction ID: {txn_id}")
+
+            # Check if we've already processed this transaction for this chat
+            if (chat_id, txn_id) in transaction_cache:
+                print(f"Transaction {txn_id} already processed, ignoring")
+                return MessageResponse(
+                    success=False,
+                    message="Duplicate transaction",
+                    auto_withdraw=None,
+                    transaction_id=txn_id
+                )
+
+            # Store this transaction in the cache (expires after 1 hour) and
+            # persist it so a retry after a restart is still caught
+            expires_at = transaction_cache.add((chat_id, txn_id))
+            event_store.append("transaction", {"chat_id": chat_id, "transaction_id": txn_id, "expires_at": expires_at})
+            print(f"Added transaction {txn_id} to cache for chat {chat_id}")
+
+        # Auto withdraw status, "Автовывод: ДА" or "Автовывод: НЕТ" (case insensitive)
+        auto_withdraw = classification.auto_withdraw
+        if auto_withdraw is None:
+            print("Auto-withdraw status not found in response")
+        else:
+            print(f"Auto-withdraw: {'YES' if auto_withdraw else 'NO'}")
+    else:
+        # Do a secondary check for Exception messages anywhere in the text
+        if classification.error is not None:
+            success = False
+            response_text = f"Error detected: {text[:100]}..."
+            print(f"Error message detected: {text[:100]}...")
+        else:
+            # Any other response is treated as unclear
+            success = False
+            response_text = "Unexpected response format"
+            print(f"Unexpected response format: {text[:100]}...")
+
+    return MessageResponse(
+        success=success,
+        message=response_text,
+        auto_withdraw=auto_withdraw,
+        transaction_id=txn_id
+    )
 
-    Returns:
-      - success: Whether the message was successfully processed
-      - message: Status message with details
-      - auto_withdraw: For payment messages, indicates if auto-withdraw is enabled (true/false/null)
+async def exchange_in_lane(chat_id, text, lane_acquired, sent=None):
+    """Send a message through the chat's lane and wait for its reply.
+
+    Returns (sent_message, response_message), the reply being None if none
+    arrived. The lane is held until the reply is seen or its deadline passes.
+    The optional `sent` future gets the sent message as soon as it is out.
     """
-    # Import asyncio
-    import asyncio
+    # Check if client is initialized
+    if not client.is_connected:
+        await client.start()
 
-    # Process with a timeout to avoid 504 Gateway Timeout errors
-    async def process_with_timeout():
-        # Check if client is initialized
-        if not client.is_connected:
-            await client.start()
+    # Wait for our turn in the chat's outbound lane
+    async with outbound_lane(chat_id) as lane:
+        # Register before sending so a fast reply can't slip past us
+        pending = register_pending_reply(chat_id, lane)
+        lane_acquired.set()
+        try:
+            # Send message
+            sent_message = await client.send_message(chat_id, text)
+            pending.set_sent(sent_message.id)
+            if sent is not None:
+                sent.set_result(sent_message)
+
+            # Wait for the reply to be pushed by the update handler
+            print(f"Waiting for response to message: {text[:30]}...")
+            response_message = await pending.wait(SEND_REPLY_TIMEOUT)
+
+            if response_message is None:
+                print("No reply delivered in time, checking chat history")
+                try:
+                    response_message = await find_reply_in_history(chat_id, sent_message.id, lane)
+                except Exception as e:
+                    print(f"Error getting response message: {e}")
+        finally:
+            unregister_pending_reply(pending)
 
-        # Send message
-        sent_message = await client.send_message(message.chat_id, message.text)
+    return sent_message, response_message
 
-        # Wait for reply message (shorter wait time to avoid 504 errors)
-        print(f"Waiting for response to message: {message.text[:30]}...")
-        # Wait 5 seconds - no need for timeout here as the whole function has a timeout
-        await asyncio.sleep(5)
+def finish_abandoned_exchange(task):
+    """Done callback of an exchange nobody waits for any more"""
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Error in abandoned send: {task.exception()}")
 
-        # Safely get response message
-        response_message = None
-        try:
-            # Get chat info for message history
-            chat = await client.get_chat(message.chat_id)
-            chat_name = chat.title if chat.title else f"User {chat.first_name}" if hasattr(chat, "first_name") else str(message.chat_id)
-
-            # Get recent messages (convert async generator to list)
-            new_messages = []
-            async for msg in client.get_chat_history(
-                message.chat_id,
-                limit=20  # Get more messages to ensure we capture the response
-            ):
-                new_messages.append(msg)
-
-                # Check for cabinet messages in history
-                if msg.text and "[" in msg.text and "]" in msg.text and ":" in msg.text:
-                    # Convert Pyrogram date to timestamp
-                    timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
-                    # Include message ID to prevent duplicates
-                    parse_cabinet_message(message.chat_id, msg.text, timestamp, chat_name, message_id=msg.id)
-
-                # Check for cancellation messages
-                if msg.text:
-                    # Convert Pyrogram date to timestamp
-                    timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
-                    # Process potential cancellation message
-                    process_cancellation_message(message.chat_id, msg.text, timestamp, chat_name, message_id=msg.id)
-
-            # Log all recent messages for debugging
-            print(f"Found {len(new_messages)} recent messages in chat")
-
-            # First check for messages explicitly containing payment confirmation
-            payment_messages = []
-            for msg in new_messages:
-                if msg.text and "Выплата добавлена в очередь" in msg.text:
-                    print(f"Found payment confirmation message: {msg.text[:50]}...")
-                    payment_messages.append(msg)
-
-            if payment_messages:
-                # Sort payment messages by date (newest first)
-                payment_messages.sort(key=lambda m: m.date, reverse=True)
-                filtered_messages = payment_messages
-                print(f"Found {len(filtered_messages)} payment confirmation messages")
-            else:
-                # If no payment messages, use normal time-based filtering
-                # Filter messages to only include those sent AFTER our message
-                sent_date = sent_message.date
-                print(f"Our message sent at: {sent_date}")
-
-                # Sort messages by date (newest first is default from Pyrogram)
-                filtered_messages = []
-                for msg in new_messages:
-                    if msg.id != sent_message.id:  # Skip our own message
-                        print(f"Message: ID={msg.id}, Date={msg.date}, Text={msg.text[:30] if msg.text else 'No text'}...")
-                        if msg.date >= sent_date:  # Use >= instead of > to catch messages sent at the same time
-                            print(f"  ✓ Message is newer than or equal to our sent message")
-                            filtered_messages.append(msg)
-                        else:
-                            print(f"  ✗ Message is older than our sent message - ignoring")
-
-                print(f"Found {len(filtered_messages)} messages after our sent message")
-
-                # If we didn't find any messages, we might need to check all messages as a fallback
-                if not filtered_messages:
-                    print("No filtered messages found. Checking all messages as fallback.")
-                    filtered_messages = [m for m in new_messages if m.id != sent_message.id]
-                    print(f"Using all {len(filtered_messages)} messages as fallback")
-
-            # First try to find messages with payment confirmation text
-            for msg in filtered_messages:
-                if "Выплата добавлена в очередь" in msg.text:
-                    print(f"Found payment confirmation message: {msg.text[:50]}...")
-                    response_message = msg
-                    break
-
-            # Also check explicitly for cabinet messages in filtered messages
-            for msg in filtered_messages:
-                if msg.text and "[" in msg.text and "]" in msg.text and ":" in msg.text:
-                    # Convert Pyrogram date to timestamp
-                    timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
-                    # Try to parse as cabinet message, including message ID
-                    parsed = parse_cabinet_message(
-                        message.chat_id,
-                        msg.text,
-                        timestamp,
-                        chat_name,
-                        message_id=msg.id
-                    )
-                    if parsed:
-                        print(f"Found and parsed cabinet message in filtered messages (ID: {msg.id})")
-
-            # If we didn't find a payment message, take the newest message after ours
-            if not response_message and filtered_messages:
-                msg = filtered_messages[0]  # First message is newest
-                print(f"Using newest message as response: {msg.text[:50]}...")
-                response_message = msg
-
-            if not response_message:
-                print("No response message found in chat history")
+def abandon_exchange(exchange):
+    """Let a started exchange run on in the background.
 
-        except Exception as e:
-            print(f"Error getting response message: {e}")
-            # Continue with default response
+    It keeps the lane until its late reply is claimed or the reply deadline
+    passes, so the next send in the lane doesn't take that reply for its own.
+    """
+    background_tasks.add(exchange)
+    exchange.add_done_callback(background_tasks.discard)
+    exchange.add_done_callback(finish_abandoned_exchange)
 
-        # Set default response - assume failure if no response message
-        success = False
-        response_text = "No response received - payment likely failed"
-        auto_withdraw = None
-
-        # Print all filtered messages for debugging
-        print(f"Filtered messages count: {len(filtered_messages)}")
-        for i, msg in enumerate(filtered_messages):
-            if msg.text:
-                print(f"Filtered message {i}: {msg.text[:100]}...")
-
-        if response_message:
-            text = response_message.text
-
-            # Log the actual message for debugging
-            print(f"Analyzing response message: {text}")
-
-            # Output the entire message for debugging
-            print("FULL RESPONSE MESSAGE:")
-            print(text)
-            print("END OF MESSAGE")
-
-            # Check for error messages
-            if "Exception: params count" in text:
-                success = False
-                response_text = "Failed: Exception params count error"
-
-            # Check for success message with transaction details
-            elif "Выплата добавлена в очередь" in text:
-                success = True
-                response_text = "Payment successfully queued"
-
-                # Extract transaction details using regex
-                txn_id = None
-                txn_match = re.search(r'Транзакция#(\d+)', text)
-                if txn_match:
-                    txn_id = txn_match.group(1)
-                    print(f"Transaction ID: {txn_id}")
-
-                    # Check if we've already processed this transaction for this chat
-                    chat_transactions = transaction_cache.get(message.chat_id, {})
-
-                    if txn_id in chat_transactions:
-                        print(f"Transaction {txn_id} already processed, ignoring")
-                        success = False
-                        response_text = "Duplicate transaction"
-                        return MessageResponse(
-                            success=success,
-                            message=response_text,
-                            auto_withdraw=None
-                        )
-
-                    # Store this transaction in the cache
-                    if message.chat_id not in transaction_cache:
-                        transaction_cache[message.chat_id] = {}
-
-                    # Store with timestamp
-                    transaction_cache[message.chat_id][txn_id] = time.time()
-                    print(f"Added transaction {txn_id} to cache for chat {message.chat_id}")
-
-                    # Clean old transactions (older than 1 hour)
-                    current_time = time.time()
-                    for chat_id in list(transaction_cache.keys()):
-                        for tx_id in list(transaction_cache[chat_id].keys()):
-                            if current_time - transaction_cache[chat_id][tx_id] > 3600:  # 1 hour
-                                del transaction_cache[chat_id][tx_id]
-                                print(f"Removed old transaction {tx_id} from cache")
-
-                # Parse auto withdraw status (case insensitive)
-                # Check for "Автовывод: ДА" or "Автовывод: НЕТ" with more flexibility
-                auto_withdraw_match = re.search(r'(?i)автовывод\s*:\s*(да|нет)', text)
-                if auto_withdraw_match:
-                    status_text = auto_withdraw_match.group(1).lower()
-                    if status_text == "да":
-                        auto_withdraw = True
-                        print("Auto-withdraw: YES")
-                    elif status_text == "нет":
-                        auto_withdraw = False
-                        print("Auto-withdraw: NO")
-                else:
-                    print("Auto-withdraw status not found in response")
-            else:
-                # Do a secondary check for Exception messages anywhere in the text
-                if any(error_msg in text for error_msg in ["Exception:", "Error:", "ошибка", "Ошибка"]):
-                    success = False
-                    response_text = f"Error detected: {text[:100]}..."
-                    print(f"Error message detected: {text[:100]}...")
-                else:
-                    # Any other response is treated as unclear
-                    success = False
-                    response_text = "Unexpected response format"
-                    print(f"Unexpected response format: {text[:100]}...")
-        else:
-            # Debug: check all messages one more time
-            print("No response message identified. Re-checking all messages:")
-            for msg in new_messages:
-                if msg.text:
-                    if "Выплата добавлена в очередь" in msg.text:
-                        print(f"Found payment confirmation: {msg.text[:50]}...")
-                        response_message = msg
-                        success = True
-                        response_text = "Payment successfully queued"
-
-                        # Extract auto-withdraw status
-                        if "автовывод: да" in msg.text.lower():
-                            auto_withdraw = True
-                        elif "автовывод: нет" in msg.text.lower():
-                            auto_withdraw = False
-                        break
+async def process_send(chat_id, text):
+    """Send a message through the chat's lane and analyze the reply.
 
-        return MessageResponse(
-            success=success,
-            message=response_text,
-            auto_withdraw=auto_withdraw
-        )
+    The whole process is capped at 20 seconds. Unexpected errors are raised.
+    """
+    # Set once we hold the lane: from then on the send may have gone out even
+    # if the timeout fires before send_message returns (e.g. a FloodWait)
+    lane_acquired = asyncio.Event()
+    # Runs as its own task, so a timeout doesn't release the lane while the
+    # reply to a message already sent is still due
+    exchange = asyncio.create_task(exchange_in_lane(chat_id, text, lane_acquired))
+
+    # Process with a timeout to avoid 504 Gateway Timeout errors
+    async def process_with_timeout():
+        sent_message, response_message = await asyncio.shield(exchange)
+
+        if not response_message:
+            print("No response message found in chat history")
+            # Assume failure if no response message
+            return MessageResponse(
+                success=False,
+                message="No response received - payment likely failed",
+                auto_withdraw=None
+            )
+
+        result = analyze_response(chat_id, response_message.text)
+        if result.success and result.transaction_id:
+            # The payout's lifecycle starts with our message
+            for state, msg in (("sent", sent_message), ("queued", response_message)):
+                timestamp = msg.date.timestamp() if hasattr(msg.date, "timestamp") else time.time()
+                payout_tracker.record(result.transaction_id, state, timestamp, chat_id=chat_id)
+            link_payout_ids(classify_message(response_message.text))
+        return result
 
     # Run with a timeout to prevent 504 Gateway Timeout errors
     try:
@@ -947,11 +2744,94 @@ async def send_message(
         return await asyncio.wait_for(process_with_timeout(), timeout=20)
     except asyncio.TimeoutError:
         print("Processing timed out, returning default response")
+        if not lane_acquired.is_set():
+            # Still queued for the lane, nothing was sent
+            exchange.cancel()
+            return MessageResponse(
+                success=False,
+                message="Processing timed out - chat is busy with other sends, message was not sent",
+                auto_withdraw=None
+            )
+        abandon_exchange(exchange)
         return MessageResponse(
             success=False,
             message="Processing timed out - message was sent but response couldn't be analyzed",
             auto_withdraw=None
         )
+    except asyncio.CancelledError:
+        # The caller went away: don't start a send nobody waits for
+        if lane_acquired.is_set():
+            abandon_exchange(exchange)
+        else:
+            exchange.cancel()
+        raise
+
+async def run_send_job(job):
+    """Background body of an async /send job"""
+    try:
+        result = await process_send(job.chat_id, job.text)
+    except Exception as e:
+        print(f"Error in send job {job.job_id}: {str(e)}")
+        result = MessageResponse(success=False, message=f"Failed to send message: {str(e)}")
+    send_jobs.finish(job, result)
+
+async def stream_batch_results(items):
+    """Run a batch of sends and yield NDJSON result lines as they complete.
+
+    Items for the same chat run in order, different chats run concurrently.
+    """
+    results = asyncio.Queue()
+
+    async def run_chat(entries):
+        for index, item in entries:
+            try:
+                result = await process_send(item.chat_id, item.text)
+            except Exception as e:
+                print(f"Error in batch item {index}: {str(e)}")
+                result = MessageResponse(success=False, message=f"Failed to send message: {str(e)}")
+            await results.put(BatchSendResult(index=index, chat_id=item.chat_id, **result.model_dump()))
+
+    by_chat = {}
+    for index, item in enumerate(items):
+        by_chat.setdefault(item.chat_id, []).append((index, item))
+
+    # Sends keep running if the client goes away, so hold on to the tasks
+    for entries in by_chat.values():
+        task = asyncio.create_task(run_chat(entries))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+    for _ in range(len(items)):
+        result = await results.get()
+        yield result.model_dump_json() + "\n"
+
+def job_status(job):
+    return JobStatus(
+        job_id=job.job_id,
+        status="done" if job.done.is_set() else "pending",
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+        result=job.result
+    )
+
+@app.post("/send", response_model=MessageResponse, tags=["Messages"])
+async def send_message(
+    message: Message,
+    api_key: APIKey = Depends(get_api_key)
+):
+    """
+    Send a message to a Telegram chat and analyze the response.
+
+    The reply is picked up as soon as Telegram delivers it (up to
+    SEND_REPLY_TIMEOUT seconds), with a chat history check as fallback.
+
+    Returns:
+      - success: Whether the message was successfully processed
+      - message: Status message with details
+      - auto_withdraw: For payment messages, indicates if auto-withdraw is enabled (true/false/null)
+    """
+    try:
+        return await process_send(message.chat_id, message.text)
     except Exception as e:
         print(f"Error in send_message endpoint: {str(e)}")
         raise HTTPException(
@@ -959,42 +2839,114 @@ async def send_message(
             detail=f"Failed to send message: {str(e)}"
         )
 
+@app.post("/send/async", response_model=JobStatus, status_code=status.HTTP_202_ACCEPTED, tags=["Messages"])
+async def send_message_async(message: Message, api_key: APIKey = Depends(get_api_key)):
+    """
+    Queue a message like POST /send, but return a job id right away.
+
+    Poll GET /jobs/{job_id} for the result. Finished results are kept
+    for JOB_RESULT_TTL seconds.
+
+    Returns:
+        The pending job
+    """
+    job = SendJob(message.chat_id, message.text)
+    send_jobs.add(job)
+    job.task = asyncio.create_task(run_send_job(job))
+    return job_status(job)
+
+@app.post("/send/batch", tags=["Messages"], responses={200: {"content": {"application/x-ndjson": {}}}})
+async def send_batch(batch: BatchSendRequest, api_key: APIKey = Depends(get_api_key)):
+    """
+    Send several messages at once.
+
+    Messages to different chats are sent concurrently, messages to the same
+    chat in the order given.
+
+    Returns:
+        NDJSON stream with one BatchSendResult per item (same fields as
+        POST /send plus index and chat_id), in completion order
+    """
+    if len(batch.items) > BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Batch too large: {len(batch.items)} items (max {BATCH_MAX_ITEMS})"
+        )
+
+    return StreamingResponse(stream_batch_results(batch.items), media_type="application/x-ndjson")
+
+@app.get("/jobs/{job_id}", response_model=JobStatus, tags=["Messages"])
+async def get_job(job_id: str, wait: float = 0, api_key: APIKey = Depends(get_api_key)):
+    """
+    Get the status of an async send job.
+
+    Args:
+        job_id: Id returned by POST /send/async
+        wait: Seconds to wait for a pending job to finish (long-poll, max JOB_MAX_WAIT)
+
+    Returns:
+        Job status, with the same result as POST /send once it is done
+    """
+    job = send_jobs.get(job_id)
+    if not job:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Job {job_id} not found or expired"
+        )
+
+    if wait > 0 and not job.done.is_set():
+        try:
+            await asyncio.wait_for(job.done.wait(), timeout=min(wait, JOB_MAX_WAIT))
+        except asyncio.TimeoutError:
+            pass
+
+    return job_status(job)
+
+def message_list_response(entries, next_cursor=None, sync_cursor=None):
+    """
+    Message list response assembled from the entries' cached JSON fragments.
+
+    Returned as a plain Response, so FastAPI skips validating and
+    re-serializing every record; response_model only documents the shape.
+    """
+    body = b"".join((
+        b'{"messages":[', b",".join(entry["payload"] for entry in entries),
+        b'],"next_cursor":', json.dumps(next_cursor).encode(),
+        b',"sync_cursor":', json.dumps(sync_cursor).encode(), b"}",
+    ))
+    return Response(content=body, media_type="application/json")
+
 @app.get("/messages/recent", response_model=CabinetMessageList, tags=["Messages"])
-async def get_recent_messages(hours: int = 3, cabinet_name: str = None, api_key: APIKey = Depends(get_api_key)):
+async def get_recent_messages(
+    hours: int = 3,
+    cabinet_name: str = None,
+    cabinet_id: str = None,
+    chat_id: int = None,
+    api_key: APIKey = Depends(get_api_key)
+):
     """
     Get cabinet messages from all chats from the last specified hours.
 
     Args:
         hours: Number of hours to look back (default: 3)
         cabinet_name: Filter by cabinet name (optional)
+        cabinet_id: Filter by cabinet id (optional)
+        chat_id: Filter by chat (optional)
 
     Returns:
         List of cabinet messages from the specified time period
     """
-    recent_messages = []
     current_time = time.time()
     time_limit = current_time - (hours * 3600)  # Convert hours to seconds
 
-    # Collect messages from all chats
-    for chat_id, messages in message_history.items():
-        for msg in messages:
-            # Filter by timestamp and cabinet name if provided
-            if (msg["timestamp"] >= time_limit and
-                (cabinet_name is None or msg["cabinet_name"].lower() == cabinet_name.lower())):
-                recent_messages.append(CabinetMessage(
-                    chat_id=chat_id,
-                    chat_name=msg["chat_name"],
-                    cabinet_name=msg["cabinet_name"],
-                    cabinet_id=msg["cabinet_id"],
-                    message=msg["message"],
-                    timestamp=msg["timestamp"],
-                    message_id=msg["message_id"]  # Include the message ID
-                ))
-
-    # Sort by timestamp (newest first)
-    recent_messages.sort(key=lambda x: x.timestamp, reverse=True)
-
-    return CabinetMessageList(messages=recent_messages)
+    # Windows beyond in-memory retention are read from the event store
+    if event_store.is_open and not message_history.holds_since(time_limit, chat_id):
+        messages = await event_store.query("cabinet", since=time_limit, chat_id=chat_id, cabinet_name=cabinet_name, cabinet_id=cabinet_id)
+    else:
+        # Collect matching messages through the indexes, already newest first
+        messages = message_history.query(since=time_limit, chat_id=chat_id, cabinet_id=cabinet_id, cabinet_name=cabinet_name)
+
+    return message_list_response(messages)
 
 @app.post("/send-to-link", response_model=MessageResponse, tags=["Messages"])
 async def send_to_link(message: LinkMessage, api_key: APIKey = Depends(get_api_key)):
@@ -1014,7 +2966,7 @@ async def send_to_link(message: LinkMessage, api_key: APIKey = Depends(get_api_k
             await client.start()
 
         # Get links
-        links = load_links()
+        links = links_registry.links
         link_idx = message.link_number - 1
 
         # Check if link exists
@@ -1028,8 +2980,21 @@ async def send_to_link(message: LinkMessage, api_key: APIKey = Depends(get_api_k
         chat_id = links[link_idx]["id"]
         link_name = links[link_idx]["name"]
 
-        # Send message
-        await client.send_message(chat_id, message.text)
+        # Send through the chat's lane, so a reply to this message is claimed
+        # here and never taken by a concurrent /send; only the send is awaited
+        sent = asyncio.get_running_loop().create_future()
+        exchange = asyncio.create_task(exchange_in_lane(chat_id, message.text, asyncio.Event(), sent))
+        try:
+            await asyncio.wait((sent, exchange), return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            # The caller went away before the message was sent
+            if not sent.done():
+                exchange.cancel()
+            raise
+        if not sent.done():
+            sent.cancel()
+            exchange.result()  # Raises the send error
+        abandon_exchange(exchange)
 
         return MessageResponse(
             success=True,
@@ -1042,98 +3007,292 @@ async def send_to_link(message: LinkMessage, api_key: APIKey = Depends(get_api_k
             detail=f"Failed to send message to link: {str(e)}"
         )
 
+def format_cursor(entry):
+    """Keyset cursor of an entry, timestamp:message_id"""
+    timestamp, message_id = entry_sort_key(entry)
+    return f"{timestamp!r}:{message_id}"
+
+def parse_cursor(cursor):
+    if cursor is None:
+        return None
+    try:
+        timestamp, message_id = cursor.split(":", 1)
+        return float(timestamp), int(message_id)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid cursor: {cursor}"
+        )
+
+def page_entries(entries, limit=None, before=None, after=None):
+    """Keyset page over newest-first entries, mirroring EventStore.page"""
+    if before is not None:
+        entries = itertools.dropwhile(lambda e: entry_sort_key(e) >= before, entries)
+    if after is not None:
+        # Paging forward returns the oldest entries past the cursor first
+        entries = list(itertools.takewhile(lambda e: entry_sort_key(e) > after, entries))
+        entries.reverse()
+    return list(itertools.islice(entries, limit or None))
+
+async def fetch_page(kind, log, limit, before, after, since, **filters):
+    """
+    Page of entries with its next and sync cursors.
+
+    Reads the event store when it is open; memory holds no insertion
+    sequence, so `since` needs the store.
+    """
+    if limit is not None and limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit must be positive"
+        )
+    before, after = parse_cursor(before), parse_cursor(after)
+
+    if event_store.is_open:
+        entries, upper = await event_store.page(
+            kind, limit=limit, before=before, after=after, after_seq=since, **filters
+        )
+    elif since is not None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Incremental sync requires the event store"
+        )
+    else:
+        entries, upper = page_entries(log.query(**filters), limit, before, after), None
+
+    full_page = bool(limit) and len(entries) == limit
+    next_cursor = sync_cursor = None
+    if since is not None:
+        # A full page resumes from its last row, otherwise the client is caught up
+        sync_cursor = entries[-1]["seq"] if full_page else upper
+    else:
+        next_cursor = format_cursor(entries[-1]) if full_page else None
+        sync_cursor = upper
+    return entries, next_cursor, sync_cursor
+
 @app.get("/messages/all", response_model=CabinetMessageList, tags=["Messages"])
-async def get_all_messages(cabinet_name: str = None, api_key: APIKey = Depends(get_api_key)):
+async def get_all_messages(
+    cabinet_name: str = None,
+    cabinet_id: str = None,
+    chat_id: int = None,
+    limit: int = None,
+    before: str = None,
+    after: str = None,
+    since: int = None,
+    api_key: APIKey = Depends(get_api_key)
+):
     """
     Get all cabinet messages from all chats.
 
     Args:
         cabinet_name: Filter by cabinet name (optional)
+        cabinet_id: Filter by cabinet id (optional)
+        chat_id: Filter by chat (optional)
+        limit: Maximum number of messages to return (optional)
+        before: Return messages older than this cursor, newest first (optional)
+        after: Return messages newer than this cursor, oldest first (optional)
+        since: sync_cursor of a previous response; return only messages
+            stored after it, in storage order (optional)
 
     Returns:
-        List of all cabinet messages
+        List of cabinet messages, with next_cursor set when more pages follow
+        and sync_cursor for the next incremental sync
     """
-    all_messages = []
+    # The event store holds everything, memory only the retained window
+    messages, next_cursor, sync_cursor = await fetch_page(
+        "cabinet", message_history, limit, before, after, since,
+        chat_id=chat_id, cabinet_name=cabinet_name, cabinet_id=cabinet_id
+    )
 
-    # Collect messages from all chats
-    for chat_id, messages in message_history.items():
-        for msg in messages:
-            # Filter by cabinet name if provided
-            if cabinet_name is None or msg["cabinet_name"].lower() == cabinet_name.lower():
-                all_messages.append(CabinetMessage(
-                    chat_id=chat_id,
-                    chat_name=msg["chat_name"],
-                    cabinet_name=msg["cabinet_name"],
-                    cabinet_id=msg["cabinet_id"],
-                    message=msg["message"],
-                    timestamp=msg["timestamp"],
-                    message_id=msg["message_id"]  # Include the message ID
-                ))
-
-    # Sort by timestamp (newest first)
-    all_messages.sort(key=lambda x: x.timestamp, reverse=True)
-
-    return CabinetMessageList(messages=all_messages)
+    return message_list_response(messages, next_cursor, sync_cursor)
 
 @app.get("/cancellations/recent", response_model=CancellationMessageList, tags=["Cancellations"])
-async def get_recent_cancellations(hours: int = 24, api_key: APIKey = Depends(get_api_key)):
+async def get_recent_cancellations(hours: int = 24, chat_id: int = None, api_key: APIKey = Depends(get_api_key)):
     """
     Get cancellation messages (containing "невозможно обработать") from all linked chats 
     from the last specified hours.
 
     Args:
         hours: Number of hours to look back (default: 24)
+        chat_id: Filter by chat (optional)
 
     Returns:
         List of cancellation messages from the specified time period
     """
-    recent_messages = []
     current_time = time.time()
     time_limit = current_time - (hours * 3600)  # Convert hours to seconds
 
-    # Collect messages from all chats
-    for chat_id, messages in cancellation_messages.items():
-        for msg in messages:
-            # Filter by timestamp
-            if msg["timestamp"] >= time_limit:
-                recent_messages.append(CancellationMessage(
-                    chat_id=chat_id,
-                    chat_name=msg["chat_name"],
-                    message=msg["message"],
-                    timestamp=msg["timestamp"],
-                    message_id=msg["message_id"]  # Include the message ID
-                ))
-
-    # Sort by timestamp (newest first)
-    recent_messages.sort(key=lambda x: x.timestamp, reverse=True)
+    # Windows beyond in-memory retention are read from the event store
+    if event_store.is_open and not cancellation_messages.holds_since(time_limit, chat_id):
+        messages = await event_store.query("cancellation", since=time_limit, chat_id=chat_id)
+    else:
+        # Collect messages from all chats, already newest first
+        messages = cancellation_messages.query(since=time_limit, chat_id=chat_id)
 
-    return CancellationMessageList(messages=recent_messages)
+    return message_list_response(messages)
 
 @app.get("/cancellations/all", response_model=CancellationMessageList, tags=["Cancellations"])
-async def get_all_cancellations(api_key: APIKey = Depends(get_api_key)):
+async def get_all_cancellations(
+    chat_id: int = None,
+    limit: int = None,
+    before: str = None,
+    after: str = None,
+    since: int = None,
+    api_key: APIKey = Depends(get_api_key)
+):
     """
     Get all cancellation messages (containing "невозможно обработать") from all linked chats.
 
+    Args:
+        chat_id: Filter by chat (optional)
+        limit: Maximum number of messages to return (optional)
+        before: Return messages older than this cursor, newest first (optional)
+        after: Return messages newer than this cursor, oldest first (optional)
+        since: sync_cursor of a previous response; return only messages
+            stored after it, in storage order (optional)
+
     Returns:
-        List of all cancellation messages
+        List of cancellation messages, with next_cursor and sync_cursor
     """
-    all_messages = []
+    # The event store holds everything, memory only the retained window
+    messages, next_cursor, sync_cursor = await fetch_page(
+        "cancellation", cancellation_messages, limit, before, after, since, chat_id=chat_id
+    )
 
-    # Collect messages from all chats
-    for chat_id, messages in cancellation_messages.items():
-        for msg in messages:
-            all_messages.append(CancellationMessage(
-                chat_id=chat_id,
-                chat_name=msg["chat_name"],
-                message=msg["message"],
-                timestamp=msg["timestamp"],
-                message_id=msg["message_id"]  # Include the message ID
-            ))
+    return message_list_response(messages, next_cursor, sync_cursor)
+
+def payout_state_fields(payout, now):
+    return {
+        "payout_id": payout.payout_id,
+        "chat_id": payout.chat_id,
+        "state": payout.state,
+        "status": payout.status,
+        "started_at": payout.started_at,
+        "state_since": payout.state_since,
+        "time_in_state": now - payout.state_since,
+        "latency": payout.latency()
+    }
+
+@app.get("/payouts/stuck", response_model=PayoutList, tags=["Payouts"])
+async def get_stuck_payouts(older_than: float = PAYOUT_STUCK_AFTER, api_key: APIKey = Depends(get_api_key)):
+    """
+    Get payouts that are not completed or cancelled and haven't changed state for a while.
+
+    Args:
+        older_than: Minimum seconds in the current state (default: PAYOUT_STUCK_AFTER)
 
-    # Sort by timestamp (newest first)
-    all_messages.sort(key=lambda x: x.timestamp, reverse=True)
+    Returns:
+        Stuck payouts, longest in their state first
+    """
+    now = time.time()
+    return PayoutList(payouts=[
+        PayoutState(**payout_state_fields(payout, now))
+        for payout in payout_tracker.stuck(older_than, now)
+    ])
+
+@app.get("/payouts/{payout_id}", response_model=PayoutStatus, tags=["Payouts"])
+async def get_payout(payout_id: str, api_key: APIKey = Depends(get_api_key)):
+    """
+    Get the lifecycle and status of a payout.
+
+    Args:
+        payout_id: Payout (Выплата#) or transaction (Транзакция#) id
+
+    Returns:
+        Current state, time in state, end-to-end latency once finished, the
+        latest cabinet status and the timeline of status updates, oldest first
+    """
+    payout = payout_tracker.get(payout_id)
+    if payout is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No events for payout {payout_id}"
+        )
+
+    # A transaction id resolves to the payout it was linked to
+    timeline = payout_index.get(payout.payout_id) or []
+    return PayoutStatus(
+        **payout_state_fields(payout, time.time()),
+        updated_at=payout.updated_at,
+        timeline=[PayoutEvent(**event) for event in timeline]
+    )
+
+def format_sse(event):
+    event_id, event_type, data = event
+    # Entries carry their encoded JSON already
+    return f"id: {event_id}\nevent: {event_type}\ndata: {data['payload'].decode()}\n\n"
 
-    return CancellationMessageList(messages=all_messages)
+async def stream_events(subscriber, last_event_id):
+    """Yield buffered events after last_event_id, then live events, as SSE"""
+    try:
+        sent_id = last_event_id
+        if last_event_id is not None:
+            events, missed = event_broker.replay(last_event_id)
+            if missed:
+                # Events between the client's id and our buffer are gone,
+                # it has to backfill from /messages/all and /cancellations/all
+                yield f"event: gap\ndata: {json.dumps({'last_event_id': last_event_id})}\n\n"
+                sent_id = None
+            for event in events:
+                if subscriber.matches(event):
+                    yield format_sse(event)
+                    sent_id = event[0]
+
+        while True:
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=EVENT_KEEPALIVE_INTERVAL)
+            except asyncio.TimeoutError:
+                if subscriber.overflowed:
+                    yield "event: overflow\ndata: {}\n\n"
+                    return
+                yield ": keep-alive\n\n"
+                continue
+
+            # Already delivered during replay
+            if sent_id is not None and event[0] <= sent_id:
+                continue
+            yield format_sse(event)
+            sent_id = event[0]
+
+            if subscriber.overflowed and subscriber.queue.empty():
+                yield "event: overflow\ndata: {}\n\n"
+                return
+    finally:
+        event_broker.subscribers.discard(subscriber)
+
+@app.get("/events/stream", tags=["Events"], responses={200: {"content": {"text/event-stream": {}}}})
+async def get_event_stream(
+    request: Request,
+    cabinet_name: str = None,
+    chat_id: int = None,
+    last_event_id: int = None,
+    api_key: APIKey = Depends(get_api_key)
+):
+    """
+    Stream cabinet and cancellation messages as Server-Sent Events.
+
+    Each event has an id, a type ("cabinet" or "cancellation") and the same
+    fields as the /messages and /cancellations endpoints. An "overflow"
+    event means the client fell too far behind and was disconnected; a "gap"
+    event means events before the resume point are no longer buffered.
+
+    Args:
+        cabinet_name: Only cabinet messages from this cabinet (optional)
+        chat_id: Only messages from this chat (optional)
+        last_event_id: Resume after this event id (or send the Last-Event-ID header)
+    """
+    if last_event_id is None and request.headers.get("last-event-id", "").isdigit():
+        last_event_id = int(request.headers["last-event-id"])
+
+    # Subscribe before replaying so nothing published in between is lost
+    subscriber = EventSubscriber(cabinet_name=cabinet_name, chat_id=chat_id)
+    event_broker.subscribers.add(subscriber)
+
+    return StreamingResponse(
+        stream_events(subscriber, last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
@@ -1180,6 +3339,9 @@ if __name__ == "__main__":
     print(f" Endpoints:")
     print(f"   - GET    /chats - List all available chats")
     print(f"   - POST   /send  - Send a message to a chat")
+    print(f"   - POST   /send/async - Queue a message and get a job id")
+    print(f"   - POST   /send/batch - Send several messages, results streamed as NDJSON")
+    print(f"   - GET    /jobs/{{job_id}} - Get the result of a queued message")
     print(f"   - GET    /links - List all links")
     print(f"   - POST   /links - Create a new link to a chat")
     print(f"   - DELETE /links - Delete a link")
@@ -1188,6 +3350,10 @@ if __name__ == "__main__":
     print(f"   - GET    /messages/all - Get all cabinet messages")
     print(f"   - GET    /cancellations/recent - Get cancellation messages from last 24 hours")
     print(f"   - GET    /cancellations/all - Get all cancellation messages")
+    print(f"   - GET    /events/stream - Stream new cabinet and cancellation messages (SSE)")
+    print(f"   - GET    /payouts/stuck - Payouts stuck in a non-final state")
+    print(f"   - GET    /payouts/{{payout_id}} - Latest status and timeline of a payout")
+    print(f"   - GET    /stats - Message storage and retention statistics")
     print(f" API Documentation: http://{local_ip}:{port}/docs")
     print(f"{'='*50}\n")
     
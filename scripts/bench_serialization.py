@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""Compare /messages/all response building: pydantic models vs cached JSON fragments.
+
+The store rows compare reading a page from the event store with its stored
+payload column against re-encoding every row (as rows without one are).
+
+Run from the project root: python scripts/bench_serialization.py [records]
+"""
+import sys
+import time
+import asyncio
+import tempfile
+from pathlib import Path
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import api_server_new as api
+
+RECORDS = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+ROUNDS = 5
+
+def make_entries(count):
+    now = time.time()
+    entries = []
+    for i in range(count):
+        entry = {
+            "cabinet_name": f"cabinet{i % 20}",
+            "cabinet_id": str(900 + i % 50),
+            "message": f"Автоматическое оповещение: Выплата#{2259417 + i} в обработке",
+            "timestamp": now - count + i,
+            "chat_id": -1001000000000 - i % 30,
+            "chat_name": f"Chat {i % 30}",
+            "message_id": i + 1,
+        }
+        entry["payload"] = api.encode_entry(entry, api.CABINET_FIELDS)
+        entries.append(entry)
+    return entries
+
+async def model_path(entries, field):
+    # What the endpoint did before: a model per record, then FastAPI
+    # validates against response_model and serializes the whole list
+    content = api.CabinetMessageList(messages=[
+        api.CabinetMessage(
+            chat_id=msg["chat_id"],
+            chat_name=msg["chat_name"],
+            cabinet_name=msg["cabinet_name"],
+            cabinet_id=msg["cabinet_id"],
+            message=msg["message"],
+            timestamp=msg["timestamp"],
+            message_id=msg["message_id"]
+        )
+        for msg in entries
+    ])
+    return JSONResponse(await serialize_response(field=field, response_content=content)).body
+
+async def fragment_path(entries, field):
+    return api.message_list_response(entries).body
+
+async def store_path(store, field):
+    entries, _ = await store.page("cabinet")
+    return api.message_list_response(entries).body
+
+def open_store(directory, entries, with_payload):
+    store = api.EventStore(Path(directory) / ("stored.db" if with_payload else "encoded.db"))
+    store.open()
+    for entry in entries:
+        store.append("cabinet", entry if with_payload else {**entry, "payload": None})
+    asyncio.run(store.flush())
+    return store
+
+async def bench(name, build, entries, field):
+    best = float("inf")
+    for _ in range(ROUNDS):
+        started = time.perf_counter()
+        body = await build(entries, field)
+        best = min(best, time.perf_counter() - started)
+    print(f"{name:<16} {best * 1000:9.1f} ms  {len(body) / 1e6:6.1f} MB")
+    return best
+
+async def main(entries, stored, encoded):
+    field = create_response_field(name="bench", type_=api.CabinetMessageList)
+    print(f"{RECORDS} records, best of {ROUNDS}")
+    models = await bench("models", model_path, entries, field)
+    fragments = await bench("fragments", fragment_path, entries, field)
+    print(f"speedup          {models / fragments:9.1f}x")
+    reencoded = await bench("store, encoded", store_path, encoded, field)
+    payloads = await bench("store, payload", store_path, stored, field)
+    print(f"speedup          {reencoded / payloads:9.1f}x")
+
+if __name__ == "__main__":
+    with tempfile.TemporaryDirectory() as directory:
+        entries = make_entries(RECORDS)
+        stored = open_store(directory, entries, with_payload=True)
+        encoded = open_store(directory, entries, with_payload=False)
+        try:
+            asyncio.run(main(entries, stored, encoded))
+        finally:
+            stored.close()
+            encoded.close()